@@ -1,28 +1,319 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, flash, redirect, url_for, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, Message, Channel, Invitation, Chat  # ← ДОБАВИТЬ Chat здесь
+from sqlalchemy import bindparam, case, func, insert, select
+from sqlalchemy.orm import selectinload
+from models import db, User, Message, ArchivedMessage, Channel, Invitation, Chat, conversation_key  # ← ДОБАВИТЬ Chat здесь
 from config import Config
+from database import chunked, init_db
+from metrics import init_metrics
+from compression import init_compression
+from serializers import FastJSONProvider, chat_data, dumps, invitation_data, message_data, user_data
+from events import bus, socket_path, EventBroker
+from batching import WriteBatcher
+from cache import user_cache
+from passwords import password_hasher, PasswordHasherBusy
+from ratelimit import rate_limiter, RateLimited
+import migrations
+import archive
+import reports
+import search
+import ledger
 from datetime import datetime
-import json
+import click
+import csv
+import io
+import math
 
 app = Flask(__name__)
 app.config.from_object(Config)
-
-# Инициализация расширений
-db.init_app(app)
+app.json = FastJSONProvider(app)
+
+# Инициализация расширений. К базе данных импорт не обращается: схему и
+# начальных пользователей создает `flask init-db` (init_database ниже)
+init_db(app)
+init_metrics(app)
+init_compression(app)
+password_hasher.init_app(app)
+rate_limiter.init_app(app)
+bus.init_app(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+user_cache.ttl = app.config['USER_CACHE_TTL']
+user_cache.maxsize = app.config['USER_CACHE_SIZE']
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # В пределах запроса Flask-Login сам хранит пользователя; между запросами
+    # берем его из кэша и присоединяем к сессии без обращения к базе
+    user_id = int(user_id)
+    cached = user_cache.get(user_id)
+    if cached is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        db.session.expunge(user)
+        user_cache.set(user_id, user)
+        cached = user
+    return db.session.merge(cached, load=False)
+
+
+def invalidate_users(user_ids=None):
+    # Кэш user_loader у каждого воркера свой: сбрасываем его во всех процессах.
+    # None - весь кэш
+    bus.emit('user_cache', None if user_ids is None else list(user_ids))
+
+
+@bus.on('user_cache')
+def drop_cached_users(user_ids):
+    if user_ids is None:
+        user_cache.clear()
+        return
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
 
 
 def is_admin():  # ← ИСПРАВЛЕНО ЗДЕСЬ (добавлено :)
     return current_user.is_authenticated and current_user.username == '@'
 
 
+def message_event(msg, viewer_id):
+    # Событие о новом сообщении с точки зрения получателя события
+    peer = msg.receiver if msg.sender_id == viewer_id else msg.sender
+    return {
+        'type': 'message',
+        'peer_id': peer.id if peer else None,
+        'peer_username': peer.username if peer else None,
+        'message': message_data(msg, viewer_id)
+    }
+
+
+def page_args(prefix='MESSAGES'):
+    # Параметры keyset-пагинации: before_id / after_id / limit
+    # Размер страницы по умолчанию и максимум - {prefix}_PAGE_SIZE[_MAX] из конфига
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', app.config[f'{prefix}_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config[f'{prefix}_PAGE_SIZE_MAX']))
+    return before_id, after_id, limit
+
+
+def message_page_statement(model, condition, before_id, after_id, limit):
+    # Одна страница из Message или ArchivedMessage; limit + 1 - признак продолжения
+    statement = select(model).where(condition(model)).options(selectinload(model.sender))
+    if after_id is not None:
+        statement = statement.where(model.id > after_id)
+    if before_id is not None:
+        statement = statement.where(model.id < before_id)
+    order = model.id.asc() if after_id is not None else model.id.desc()
+    return statement.order_by(order).limit(limit + 1)
+
+
+def needs_archive_page(rows, after_id, limit, lowest_hot_id=None):
+    # Архив старше горячей части, поэтому полная горячая страница его не касается.
+    # При догрузке новых сообщений архив нужен, только если after_id ниже
+    # самого раннего горячего сообщения переписки (lowest_hot_id_statement)
+    if after_id is None:
+        return len(rows) <= limit
+    return lowest_hot_id is None or after_id < lowest_hot_id
+
+
+def lowest_hot_id_statement(condition):
+    # По индексу ix_message_conversation: одно чтение начала диапазона
+    return select(func.min(Message.id)).where(condition(Message))
+
+
+def merge_message_pages(rows, archived, after_id, limit):
+    # Возвращает страницу по возрастанию id и флаг наличия продолжения
+    descending = after_id is None
+    if archived:
+        merged = {msg.id: msg for msg in archived}
+        merged.update((msg.id, msg) for msg in rows)
+        rows = sorted(merged.values(), key=lambda msg: msg.id, reverse=descending)[:limit + 1]
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return (list(reversed(rows)) if descending else rows), has_more
+
+
+def paginate_messages(condition, before_id=None, after_id=None, limit=50):
+    # after_id - режим догрузки новых сообщений, иначе - последние (или до before_id).
+    # condition(model) строит фильтр для Message и для ArchivedMessage: когда
+    # горячая история кончается, страница дочитывается из архива
+    rows = db.session.scalars(message_page_statement(Message, condition, before_id, after_id, limit)).all()
+    lowest_hot_id = None
+    if after_id is not None:
+        lowest_hot_id = db.session.scalar(lowest_hot_id_statement(condition))
+    archived = []
+    if needs_archive_page(rows, after_id, limit, lowest_hot_id):
+        archived = db.session.scalars(
+            message_page_statement(ArchivedMessage, condition, before_id, after_id, limit)).all()
+    return merge_message_pages(rows, archived, after_id, limit)
+
+
+def conditional_response(etag, build):
+    # 304 без построения тела, если у клиента уже есть эта версия.
+    # ETag обозначает версию данных, а не байты ответа (тело может быть сжато
+    # по-разному), поэтому он всегда слабый - одинаковый у 304 и у 200
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = build()
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def conversation_version_statement(user_id, peer_id):
+    # Последний id переписки: только чтение индекса ix_message_conversation
+    return select(func.max(Message.id)).where(Message.between(user_id, peer_id))
+
+
+def conversation_version(user_id, peer_id):
+    return db.session.scalar(conversation_version_statement(user_id, peer_id)) or 0
+
+
+def messages_etag(user_id, peer_id, version, before_id, after_id, limit):
+    return f'messages-{user_id}-{peer_id}-{version}-{before_id}-{after_id}-{limit}'
+
+
+def chat_list_version_statement(user_id):
+    # Меняется при появлении чата, новом сообщении и изменении отметок прочтения
+    return select(
+        func.count(Chat.id), func.max(Chat.id), func.max(Chat.last_message_id),
+        func.sum(Chat.low_unread_count + Chat.high_unread_count),
+        func.sum(Chat.low_last_read_id + Chat.high_last_read_id)
+    ).where(Chat.of_user(user_id))
+
+
+def chat_list_etag(user_id, version_row, before_id=None, limit=None):
+    count, last_chat_id, last_message_id, unread, read = version_row
+    return (f'chats-{user_id}-{count}.{last_chat_id or 0}.{last_message_id or 0}.{unread or 0}.{read or 0}'
+            f'-{before_id}-{limit}')
+
+
+def read_state_changes(messages):
+    # Для каждой переписки: сколько сообщений получила каждая сторона и до
+    # какого id она прочитала (отправка сообщения отмечает чат прочитанным)
+    changes = {}
+    for msg in messages:
+        low, high = conversation_key(msg.sender_id, msg.receiver_id)
+        state = changes.setdefault((low, high), {})
+        sender_side = 'low' if msg.sender_id == low else 'high'
+        receiver_side = 'high' if sender_side == 'low' else 'low'
+        state[sender_side] = {'read_id': msg.id, 'unread': 0}
+        receiver = state.setdefault(receiver_side, {'read_id': None, 'unread': 0})
+        receiver['unread'] += 1
+    return changes
+
+
+def chat_summaries_update(latest, read_states):
+    # Один UPDATE (executemany) на все переписки пачки, без чтения; выполняется
+    # до commit, в той же транзакции. Счетчики непрочитанных меняются
+    # инкрементом, историю не пересчитываем. Возвращает (statement, params)
+    # Параллельные commit одного чата (асинхронный режим, PostgreSQL) могут
+    # прийти не по порядку id: сводка и отметка прочтения только растут
+    chat = Chat.__table__
+    message_id = bindparam('message_id', type_=db.Integer)
+    newer = message_id > func.coalesce(chat.c.last_message_id, 0)
+    values = {
+        'last_message_id': case((newer, message_id), else_=chat.c.last_message_id),
+        'last_message_at': case((newer, bindparam('message_at', type_=db.DateTime)), else_=chat.c.last_message_at)
+    }
+    for side in ('low', 'high'):
+        read_id = bindparam(f'{side}_read_id', type_=db.Integer)
+        unread = bindparam(f'{side}_unread', type_=db.Integer)
+        last_read_id = chat.c[f'{side}_last_read_id']
+        # NULL (сторона только получала) тоже не новее
+        read_newer = read_id > func.coalesce(last_read_id, 0)
+        values[f'{side}_last_read_id'] = case((read_newer, read_id), else_=last_read_id)
+        values[f'{side}_unread_count'] = case(
+            (read_newer, unread),
+            else_=func.coalesce(chat.c[f'{side}_unread_count'], 0) + unread
+        )
+
+    params = []
+    for (low, high), msg in latest.items():
+        row = {'low': low, 'high': high, 'message_id': msg.id, 'message_at': msg.timestamp}
+        for side in ('low', 'high'):
+            state = read_states[(low, high)].get(side, {'read_id': None, 'unread': 0})
+            row[f'{side}_read_id'] = state['read_id']
+            row[f'{side}_unread'] = state['unread']
+        params.append(row)
+
+    return chat.update().where(
+        (chat.c.user_low == bindparam('low')) & (chat.c.user_high == bindparam('high'))
+    ).values(values), params
+
+
+def publish_message(msg):
+    # Вызывается после commit: рассылаем событие обоим участникам
+    for user_id in {msg.sender_id, msg.receiver_id}:
+        if user_id is not None:
+            bus.publish(user_id, message_event(msg, user_id))
+
+
+def store_messages(messages):
+    # Вставка пачки сообщений одной транзакцией вместе со сводками чатов
+    db.session.add_all(messages)
+    db.session.flush()
+    return commit_messages(messages)
+
+
+def commit_messages(messages):
+    # Сообщения уже вставлены: обновляем сводки чатов, фиксируем и рассылаем
+    latest = {}
+    for msg in messages:
+        latest[conversation_key(msg.sender_id, msg.receiver_id)] = msg
+    db.session.execute(*chat_summaries_update(latest, read_state_changes(messages)))
+
+    # Участников загружаем заранее, чтобы события не подгружали их по одному
+    participant_ids = list({user_id for msg in messages
+                            for user_id in (msg.sender_id, msg.receiver_id) if user_id is not None})
+    participants = []
+    for chunk in chunked(participant_ids):
+        participants += User.query.filter(User.id.in_(chunk)).all()
+
+    # id и события собираем до commit, пока атрибуты не сброшены
+    ids = [msg.id for msg in messages]
+    events = [(user_id, message_event(msg, user_id))
+              for msg in messages
+              for user_id in {msg.sender_id, msg.receiver_id} if user_id is not None]
+    db.session.commit()
+
+    for user_id, event in events:
+        bus.publish(user_id, event)
+    return ids
+
+
+message_batcher = WriteBatcher(
+    app,
+    lambda rows: store_messages([Message(**row) for row in rows]),
+    max_batch=app.config['MESSAGE_BATCH_SIZE'],
+    max_delay=app.config['MESSAGE_BATCH_DELAY_MS'] / 1000
+)
+
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    flash('Сервер перегружен, попробуйте войти через несколько секунд')
+    response = app.make_response((render_template('login.html', register=request.path == '/register'), 503))
+    response.headers['Retry-After'] = '5'
+    return response
+
+
+@app.errorhandler(RateLimited)
+def rate_limited(error):
+    if request.endpoint == 'login':
+        flash('Слишком много попыток входа, попробуйте позже')
+        response = app.make_response((render_template('login.html', register=False), 429))
+    else:
+        response = jsonify({'status': 'error', 'message': 'Слишком много запросов, попробуйте позже'})
+        response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+
 # Маршруты
 @app.route('/')
 def index():
@@ -30,6 +321,7 @@ def index():
 
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login', by='ip', methods=('POST',))
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('main'))
@@ -43,6 +335,11 @@ def login():
             user = User.query.filter_by(username=username).first()
 
             if user and user.check_password(password):
+                # Параметры хеширования изменились - пересчитываем, пока знаем пароль
+                if password_hasher.needs_rehash(user.password_hash):
+                    user.set_password(password)
+                    db.session.commit()
+                    invalidate_users([user.id])
                 login_user(user)
                 return redirect(url_for('main'))
             flash('Неверное имя пользователя или пароль')
@@ -95,41 +392,53 @@ def register():
 @app.route('/main')
 @login_required
 def main():
-    personal_messages = Message.query.filter(
-        (Message.receiver_id == current_user.id) |
-        (Message.sender_id == current_user.id)
-    ).order_by(Message.timestamp.asc()).all()
-
-    invitations = Invitation.query.filter_by(invited_user_id=current_user.id, status='pending').all()
+    # Только оболочка страницы: чаты, переписка и приглашения загружаются
+    # через API постранично, поэтому время ответа не зависит от истории
+    # Курсор для потока событий: всё, что новее, придет через /api/stream
+    stream_since = db.session.query(func.max(Message.id)).scalar() or 0
 
     return render_template('main.html',
                            user=current_user,
-                           messages=personal_messages,
-                           invitations=invitations)
+                           pending_invitations=pending_invitations_count(current_user.id),
+                           stream_since=stream_since)
 
 
 @app.route('/api/create_chat', methods=['POST'])
 @login_required
+@rate_limiter.limit('create_chat')
 def create_chat():
     try:
         data = request.get_json()
         receiver_id = data.get('receiver_id')
 
         # Проверяем, существует ли уже чат
-        existing_chat = Chat.query.filter(
-            ((Chat.user1_id == current_user.id) & (Chat.user2_id == receiver_id)) |
-            ((Chat.user1_id == receiver_id) & (Chat.user2_id == current_user.id))
-        ).first()
+        existing_chat = Chat.query.filter(Chat.between(current_user.id, receiver_id)).first()
 
         if existing_chat:
             return jsonify({'status': 'success', 'chat_id': existing_chat.id})
 
+        # Переписка могла начаться до создания чата
+        last_message = Message.query.filter(
+            Message.between(current_user.id, receiver_id)
+        ).order_by(Message.id.desc()).first()
+
         # Создаем новый чат
         new_chat = Chat(
             user1_id=current_user.id,
             user2_id=receiver_id,
-            created_at=datetime.utcnow()
+            created_at=datetime.utcnow(),
+            last_message_id=last_message.id if last_message else None,
+            last_message_at=last_message.timestamp if last_message else None
         )
+        if last_message:
+            # Создатель видел переписку, собеседнику она засчитывается непрочитанной
+            side = 'low' if conversation_key(current_user.id, receiver_id)[0] == current_user.id else 'high'
+            peer_side = 'high' if side == 'low' else 'low'
+            setattr(new_chat, f'{side}_last_read_id', last_message.id)
+            setattr(new_chat, f'{peer_side}_unread_count', Message.query.filter(
+                Message.between(current_user.id, receiver_id),
+                Message.receiver_id == receiver_id
+            ).count())
         db.session.add(new_chat)
         db.session.commit()
 
@@ -143,34 +452,124 @@ def create_chat():
 @login_required
 def get_user_chats():
     try:
-        # Получаем все чаты пользователя
-        chats = Chat.query.filter(
-            (Chat.user1_id == current_user.id) | (Chat.user2_id == current_user.id)
+        before_id, _, limit = page_args('CHATS')
+        version = db.session.execute(chat_list_version_statement(current_user.id)).one()
+        etag = chat_list_etag(current_user.id, version, before_id, limit)
+        return conditional_response(etag, lambda: build_user_chats(before_id, limit))
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+
+def user_chats_statement(user_id, cursor=None, limit=None):
+    # Чаты пользователя с собеседником и последним сообщением одним запросом.
+    # cursor - (last_message_at, id) последнего чата предыдущей страницы,
+    # limit + 1 строк - признак продолжения
+    other_user_id = case((Chat.user1_id == user_id, Chat.user2_id), else_=Chat.user1_id)
+    peer_last_read_id = case((Chat.user_low == user_id, Chat.high_last_read_id),
+                             else_=Chat.low_last_read_id)
+    statement = select(
+        Chat.id, User.id, User.username, Message.content, Chat.last_message_at,
+        Chat.unread_count_of(user_id), peer_last_read_id
+    ).join(
+        User, User.id == other_user_id
+    ).outerjoin(
+        Message, Message.id == Chat.last_message_id
+    ).where(
+        Chat.of_user(user_id)
+    ).order_by(
+        Chat.last_message_at.desc().nullslast(), Chat.id.desc()
+    )
+    if cursor is not None:
+        last_at, chat_id = cursor
+        # Тот же порядок, что в order_by: чаты без сообщений идут последними
+        after = Chat.last_message_at.is_(None) & (Chat.id < chat_id)
+        if last_at is not None:
+            after = ((Chat.last_message_at < last_at)
+                     | ((Chat.last_message_at == last_at) & (Chat.id < chat_id))
+                     | Chat.last_message_at.is_(None))
+        statement = statement.where(after)
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    return statement
+
+
+def chat_cursor_statement(user_id, before_id):
+    return select(Chat.last_message_at, Chat.id).where(Chat.id == before_id, Chat.of_user(user_id))
+
+
+def chats_page(rows, limit):
+    return {'status': 'success', 'chats': [chat_data(row) for row in rows[:limit]], 'has_more': len(rows) > limit}
+
+
+def build_user_chats(before_id, limit):
+    cursor = None
+    if before_id is not None:
+        cursor = db.session.execute(chat_cursor_statement(current_user.id, before_id)).first()
+        if cursor is None:
+            return jsonify({'status': 'error', 'message': 'Чат не найден'})
+    rows = db.session.execute(user_chats_statement(current_user.id, cursor, limit)).all()
+    return jsonify(chats_page(rows, limit))
+
+
+@app.route('/api/unread_counts')
+@login_required
+def unread_counts():
+    try:
+        # Счетчики хранятся в самих чатах, история сообщений не читается
+        other_user_id = case((Chat.user1_id == current_user.id, Chat.user2_id), else_=Chat.user1_id)
+        rows = db.session.query(other_user_id, Chat.unread_count_of(current_user.id)).filter(
+            Chat.of_user(current_user.id)
         ).all()
 
-        chats_data = []
-        for chat in chats:
-            # Определяем собеседника
-            if chat.user1_id == current_user.id:
-                other_user = User.query.get(chat.user2_id)
-            else:
-                other_user = User.query.get(chat.user1_id)
+        counts = {str(peer_id): unread or 0 for peer_id, unread in rows}
+        return jsonify({'status': 'success', 'unread': counts, 'total': sum(counts.values())})
 
-            # Получаем последнее сообщение в чате
-            last_message = Message.query.filter(
-                ((Message.sender_id == current_user.id) & (Message.receiver_id == other_user.id)) |
-                ((Message.sender_id == other_user.id) & (Message.receiver_id == current_user.id))
-            ).order_by(Message.timestamp.desc()).first()
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
 
-            chats_data.append({
-                'chat_id': chat.id,
-                'other_user_id': other_user.id,
-                'other_username': other_user.username,
-                'last_message': last_message.content if last_message else 'Нет сообщений',
-                'last_message_time': last_message.timestamp.isoformat() if last_message else None
-            })
 
-        return jsonify({'status': 'success', 'chats': chats_data})
+@app.route('/api/mark_read', methods=['POST'])
+@login_required
+def mark_read():
+    try:
+        data = request.get_json()
+        peer_id = int(data.get('peer_id'))
+
+        chat = Chat.query.filter(Chat.between(current_user.id, peer_id)).first()
+        if not chat or not chat.last_message_id:
+            return jsonify({'status': 'success', 'last_read_id': 0, 'unread_count': 0})
+
+        message_id = min(int(data.get('message_id') or chat.last_message_id), chat.last_message_id)
+        side = 'low' if chat.user_low == current_user.id else 'high'
+        last_read_column = getattr(Chat, f'{side}_last_read_id')
+
+        # Остаток считается в той же инструкции по индексу переписки и
+        # затрагивает только сообщения после отметки, не всю историю
+        remaining = db.session.query(func.count(Message.id)).filter(
+            Message.between(current_user.id, peer_id),
+            Message.id > message_id,
+            Message.receiver_id == current_user.id
+        ).scalar_subquery()
+        updated = Chat.query.filter(
+            Chat.id == chat.id,
+            func.coalesce(last_read_column, 0) < message_id
+        ).update({
+            f'{side}_last_read_id': message_id,
+            f'{side}_unread_count': remaining
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if updated:
+            unread = db.session.query(Chat.unread_count_of(current_user.id)).filter(
+                Chat.id == chat.id).scalar() or 0
+            bus.publish(peer_id, {'type': 'read', 'peer_id': current_user.id, 'last_read_id': message_id})
+            bus.publish(current_user.id, {'type': 'unread', 'peer_id': peer_id, 'unread_count': unread})
+        else:
+            unread = getattr(chat, f'{side}_unread_count') or 0
+            message_id = getattr(chat, f'{side}_last_read_id') or 0
+
+        return jsonify({'status': 'success', 'last_read_id': message_id, 'unread_count': unread})
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
@@ -189,12 +588,115 @@ def admin_panel():
         flash('Доступ запрещен')
         return redirect(url_for('main'))
 
-    users = User.query.all()
-    return render_template('admin.html', user=current_user, users=users)
+    filters = admin_user_filters()
+    before_id, after_id, limit = page_args('ADMIN')
+
+    # Keyset-пагинация по id: страница не зависит от размера таблицы
+    query = User.query.filter(*filters)
+    if before_id is not None:
+        rows = query.filter(User.id < before_id).order_by(User.id.desc()).limit(limit + 1).all()
+        has_prev, has_next = len(rows) > limit, True
+        users = list(reversed(rows[:limit]))
+    else:
+        if after_id is not None:
+            query = query.filter(User.id > after_id)
+        rows = query.order_by(User.id.asc()).limit(limit + 1).all()
+        has_prev, has_next = after_id is not None, len(rows) > limit
+        users = rows[:limit]
+
+    # Фильтры из query string для ссылок пагинации и экспорта
+    filter_args = {key: value for key, value in request.args.items()
+                   if key in ADMIN_FILTER_ARGS and value != ''}
+    return render_template('admin.html',
+                           user=current_user,
+                           users=users,
+                           filters=filter_args,
+                           limit=limit,
+                           report=reports.latest_report(),
+                           prev_before_id=users[0].id if users and has_prev else None,
+                           next_after_id=users[-1].id if users and has_next else None)
+
+
+ADMIN_FILTER_ARGS = ('banned', 'premium', 'min_balance', 'max_balance')
+EXPORT_FIELDS = ('id', 'username', 'email', 'glass_balance', 'is_premium', 'is_banned', 'created_at')
+
+
+def admin_user_filters():
+    # Фильтры списка пользователей из query string: banned, premium, min_balance, max_balance
+    filters = [User.id != 1]
+    for arg, column in (('banned', User.is_banned), ('premium', User.is_premium)):
+        value = request.args.get(arg)
+        if value in ('1', 'true'):
+            filters.append(column.is_(True))
+        elif value in ('0', 'false'):
+            filters.append(column.isnot(True))
+    min_balance = request.args.get('min_balance', type=int)
+    if min_balance is not None:
+        filters.append(User.glass_balance >= min_balance)
+    max_balance = request.args.get('max_balance', type=int)
+    if max_balance is not None:
+        filters.append(User.glass_balance <= max_balance)
+    return filters
+
+
+def iter_users(filters, chunk_size):
+    # Читает пользователей порциями по id, в памяти не больше одной порции
+    columns = [getattr(User, field) for field in EXPORT_FIELDS]
+    last_id = 0
+    while True:
+        rows = db.session.query(*columns).filter(*filters, User.id > last_id) \
+            .order_by(User.id.asc()).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+@app.route('/admin/export_users')
+@login_required
+def admin_export_users():
+    if not is_admin():
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'})
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'status': 'error', 'message': 'Неизвестный формат'})
+
+    filters = admin_user_filters()
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for rows in iter_users(filters, chunk_size):
+            writer.writerows([export_value(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_ndjson():
+        for rows in iter_users(filters, chunk_size):
+            yield b''.join(dumps(dict(zip(EXPORT_FIELDS, row))) + b'\n' for row in rows)
+
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=users.{export_format}'
+    })
 
 
 @app.route('/api/search_users')
 @login_required
+@rate_limiter.limit('search_users')
 def search_users():
     query = request.args.get('q', '').strip()
     if not query:
@@ -202,19 +704,9 @@ def search_users():
 
     try:
         # Ищем пользователей по username (кроме текущего и бота)
-        users = User.query.filter(
-            User.username.ilike(f'%{query}%'),
-            User.id != current_user.id,
-            User.id != 1
-        ).limit(10).all()
-
-        users_data = [{
-            'id': user.id,
-            'username': user.username,
-            'avatar': user.avatar_url
-        } for user in users]
+        users = search.search_users(query, exclude_ids=(current_user.id, 1), limit=10)
 
-        return jsonify({'status': 'success', 'users': users_data})
+        return jsonify({'status': 'success', 'users': [user_data(user) for user in users]})
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
@@ -222,33 +714,41 @@ def search_users():
 
 @app.route('/api/send_message', methods=['POST'])
 @login_required
+@rate_limiter.limit('send_message')
 def send_message():
     try:
         data = request.get_json()
         content = data.get('content', '').strip()
-        receiver_id = data.get('receiver_id')
+        try:
+            # Строка '4' прошла бы в базу, но события ушли бы мимо подписчиков с int-ключами
+            receiver_id = int(data.get('receiver_id'))
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'Не указан получатель'})
 
         if not content:
             return jsonify({'status': 'error', 'message': 'Сообщение не может быть пустым'})
 
-        message = Message(
-            sender_id=current_user.id,
-            receiver_id=receiver_id,
-            content=content,
-            content_type='text',
-            timestamp=datetime.utcnow()
-        )
+        row = {
+            'sender_id': current_user.id,
+            'receiver_id': receiver_id,
+            'content': content,
+            'content_type': 'text',
+            'timestamp': datetime.utcnow()
+        }
 
-        db.session.add(message)
-        db.session.commit()
+        if app.config['MESSAGE_BATCHING']:
+            # Ответ уходит только после commit пачки с этим сообщением
+            message_id = message_batcher.submit(row, timeout=app.config['MESSAGE_BATCH_TIMEOUT'])
+        else:
+            message_id, = store_messages([Message(**row)])
 
         return jsonify({
             'status': 'success',
             'message': {
-                'id': message.id,
-                'content': message.content,
+                'id': message_id,
+                'content': content,
                 'sender': current_user.username,
-                'timestamp': message.timestamp.isoformat()
+                'timestamp': row['timestamp']
             }
         })
 
@@ -260,35 +760,81 @@ def send_message():
 @login_required
 def get_messages(receiver_id):
     try:
-        if receiver_id == 1:
-            messages = Message.query.filter(
-                ((Message.receiver_id == current_user.id) & (Message.sender_id == 1)) |
-                ((Message.sender_id == current_user.id) & (Message.receiver_id == 1))
-            ).order_by(Message.timestamp.asc()).all()
-        else:
-            messages = Message.query.filter(
-                ((Message.sender_id == current_user.id) & (Message.receiver_id == receiver_id)) |
-                ((Message.sender_id == receiver_id) & (Message.receiver_id == current_user.id))
-            ).order_by(Message.timestamp.asc()).all()
-
-        messages_data = []
-        for msg in messages:
-            messages_data.append({
-                'id': msg.id,
-                'content': msg.content,
-                'sender': msg.sender.username if msg.sender else 'Unknown',
-                'timestamp': msg.timestamp.isoformat(),
-                'is_own': msg.sender_id == current_user.id,
-                'content_type': msg.content_type,
-                'invitation_id': msg.invitation_id
-            })
-
-        return jsonify({'status': 'success', 'messages': messages_data})
+        before_id, after_id, limit = page_args()
+        version = conversation_version(current_user.id, receiver_id)
+        etag = messages_etag(current_user.id, receiver_id, version, before_id, after_id, limit)
+
+        def build():
+            messages, has_more = paginate_messages(
+                lambda model: model.between(current_user.id, receiver_id),
+                before_id, after_id, limit
+            )
+
+            messages_data = [message_data(msg, current_user.id) for msg in messages]
+            return jsonify({'status': 'success', 'messages': messages_data, 'has_more': has_more})
+
+        return conditional_response(etag, build)
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
 
+@app.route('/api/stream')
+@login_required
+def stream_events():
+    user_id = current_user.id
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since') or 0)
+    except ValueError:
+        since = 0
+
+    # Подписываемся до чтения пропущенных сообщений, чтобы ничего не потерять
+    subscription = bus.subscribe(user_id)
+    backlog = []
+    if since:
+        missed = Message.query.filter(
+            Message.of_user(user_id),
+            Message.id > since
+        ).order_by(Message.id.asc()).limit(app.config['STREAM_BACKLOG_LIMIT']).all()
+        backlog = [message_event(msg, user_id) for msg in missed]
+
+    keepalive = app.config['STREAM_KEEPALIVE']
+
+    def generate():
+        # Живые события пропускаются, только если то же сообщение уже ушло из
+        # backlog. Сравнивать с последним id нельзя: каждый поток публикует
+        # после своего commit, и сообщения приходят не по порядку id
+        sent_ids = {event['message']['id'] for event in backlog}
+        try:
+            yield 'retry: 3000\n\n'
+            for event in backlog:
+                yield format_sse(event)
+
+            while True:
+                event = subscription.get(timeout=keepalive)
+                if event is None:
+                    # Комментарий SSE держит соединение и выявляет отключившихся клиентов
+                    yield ': keepalive\n\n'
+                    continue
+                if 'message' in event and event['message']['id'] in sent_ids:
+                    continue
+                yield format_sse(event)
+        finally:
+            bus.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def format_sse(event):
+    data = dumps(event).decode()
+    # Курсор Last-Event-ID двигают только сообщения
+    event_id = f"id: {event['message']['id']}\n" if 'message' in event else ''
+    return f"{event_id}event: {event['type']}\ndata: {data}\n\n"
+
+
 @app.route('/api/invite/send', methods=['POST'])
 @login_required
 def send_invitation():
@@ -297,29 +843,11 @@ def send_invitation():
         invited_username = data.get('username')
         channel_name = data.get('channel_name')
 
-        invited_user = User.query.filter_by(username=invited_username).first()
-        if not invited_user:
+        invited_user_id = db.session.query(User.id).filter_by(username=invited_username).scalar()
+        if not invited_user_id:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
 
-        invitation = Invitation(
-            inviter_id=current_user.id,
-            invited_user_id=invited_user.id,
-            channel_name=channel_name,
-            status='pending'
-        )
-        db.session.add(invitation)
-        db.session.flush()
-
-        bot_message = Message(
-            sender_id=1,
-            receiver_id=invited_user.id,
-            content=f'🎉 {current_user.username} приглашает вас в канал "{channel_name}"',
-            content_type='invitation',
-            invitation_id=invitation.id,
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(bot_message)
-        db.session.commit()
+        create_invitations([invited_user_id], channel_name)
 
         return jsonify({'status': 'success', 'message': 'Приглашение отправлено'})
 
@@ -327,6 +855,144 @@ def send_invitation():
         return jsonify({'status': 'error', 'message': str(e)})
 
 
+@app.route('/api/invite/send_bulk', methods=['POST'])
+@login_required
+def send_invitations_bulk():
+    try:
+        data = request.get_json()
+        usernames = list(dict.fromkeys(data.get('usernames') or []))
+        channel_name = data.get('channel_name')
+
+        if not channel_name or not usernames:
+            return jsonify({'status': 'error', 'message': 'Укажите канал и пользователей'})
+        if len(usernames) > app.config['INVITE_BULK_MAX']:
+            return jsonify({'status': 'error',
+                            'message': f'Не больше {app.config["INVITE_BULK_MAX"]} пользователей за раз'})
+
+        found = user_ids_by_username(usernames)
+
+        # Уже приглашенные в этот канал и еще не ответившие
+        already_invited = set()
+        found_ids = list(found.values())
+        for chunk in chunked(found_ids):
+            already_invited.update(user_id for user_id, in db.session.query(Invitation.invited_user_id).filter(
+                Invitation.invited_user_id.in_(chunk),
+                Invitation.status == 'pending',
+                Invitation.channel_name == channel_name
+            ))
+
+        results = []
+        invited_ids = []
+        for username in usernames:
+            user_id = found.get(username)
+            if user_id is None:
+                status = 'not_found'
+            elif user_id in (current_user.id, 1):
+                status = 'skipped'
+            elif user_id in already_invited:
+                status = 'already_invited'
+            else:
+                status = 'sent'
+                invited_ids.append(user_id)
+            results.append({'username': username, 'status': status})
+
+        if invited_ids:
+            create_invitations(invited_ids, channel_name)
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Отправлено приглашений: {len(invited_ids)}',
+            'sent': len(invited_ids),
+            'results': results
+        })
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+
+def create_invitations(invited_ids, channel_name):
+    # Приглашения и сообщения бота вставляются многострочными INSERT в одной
+    # транзакции. Порядок RETURNING не гарантирован, поэтому строки
+    # сопоставляются по invited_user_id и invitation_id
+    now = datetime.utcnow()
+    invitation_ids = dict(db.session.execute(
+        insert(Invitation).returning(Invitation.invited_user_id, Invitation.id),
+        [{
+            'inviter_id': current_user.id,
+            'invited_user_id': user_id,
+            'channel_name': channel_name,
+            'status': 'pending',
+            'created_at': now
+        } for user_id in invited_ids]
+    ).all())
+
+    # Массовая вставка не вызывает before_insert, ключ переписки задаем сами
+    content = f'🎉 {current_user.username} приглашает вас в канал "{channel_name}"'
+    message_ids = [message_id for message_id, in db.session.execute(
+        insert(Message).returning(Message.id),
+        [dict(zip(('user_low', 'user_high'), conversation_key(1, user_id)),
+              sender_id=1,
+              receiver_id=user_id,
+              content=content,
+              content_type='invitation',
+              invitation_id=invitation_ids[user_id],
+              timestamp=now) for user_id in invited_ids]
+    )]
+
+    messages = []
+    for chunk in chunked(message_ids):
+        messages += Message.query.filter(Message.id.in_(chunk)).all()
+    messages.sort(key=lambda msg: msg.id)
+    commit_messages(messages)
+    return list(invitation_ids.values())
+
+
+def user_ids_by_username(usernames):
+    # username -> id, запросами IN по IN_CHUNK_SIZE имен
+    found = {}
+    for chunk in chunked(usernames):
+        found.update(db.session.query(User.username, User.id).filter(
+            User.username.in_(chunk)
+        ).all())
+    return found
+
+
+def pending_invitations_count(user_id):
+    # Покрывается индексом ix_invitation_invited_status
+    return db.session.scalar(select(func.count()).select_from(Invitation).where(
+        Invitation.invited_user_id == user_id, Invitation.status == 'pending'
+    ))
+
+
+@app.route('/api/invitations')
+@login_required
+def get_invitations():
+    try:
+        before_id, _, limit = page_args('INVITATIONS')
+        statement = select(
+            Invitation.id, Invitation.channel_name, User.username, Invitation.created_at
+        ).join(
+            User, User.id == Invitation.inviter_id
+        ).where(
+            Invitation.invited_user_id == current_user.id, Invitation.status == 'pending'
+        ).order_by(Invitation.id.desc()).limit(limit + 1)
+        if before_id is not None:
+            statement = statement.where(Invitation.id < before_id)
+        rows = db.session.execute(statement).all()
+
+        result = {
+            'status': 'success',
+            'invitations': [invitation_data(row) for row in rows[:limit]],
+            'has_more': len(rows) > limit
+        }
+        if before_id is None:
+            result['pending'] = pending_invitations_count(current_user.id)
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+
 @app.route('/api/invite/respond', methods=['POST'])
 @login_required
 def respond_invitation():
@@ -355,6 +1021,7 @@ def respond_invitation():
         )
         db.session.add(bot_message)
         db.session.commit()
+        publish_message(bot_message)
 
         return jsonify({'status': 'success', 'message': message_content})
 
@@ -379,7 +1046,7 @@ def admin_user_info(username):
             'email': user.email,
             'glass_balance': user.glass_balance,
             'is_banned': user.is_banned,
-            'created_at': user.created_at.isoformat() if user.created_at else None
+            'created_at': user.created_at
         }
     })
 
@@ -395,14 +1062,15 @@ def admin_give_glass():
         username = data.get('username')
         amount = int(data.get('amount', 0))
 
-        user = User.query.filter_by(username=username).first()
-        if not user:
+        user_id = db.session.query(User.id).filter_by(username=username).scalar()
+        if not user_id:
             return jsonify({'status': 'error', 'message': 'Пользователь не найден'})
 
-        user.glass_balance += amount
+        new_balance = ledger.credit_user(user_id, amount, 'admin_grant')
         db.session.commit()
+        invalidate_users([user_id])
 
-        return jsonify({'status': 'success', 'new_balance': user.glass_balance})
+        return jsonify({'status': 'success', 'new_balance': new_balance})
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
@@ -421,16 +1089,45 @@ def admin_give_glass_all():
         if amount <= 0:
             return jsonify({'status': 'error', 'message': 'Неверное количество'})
 
-        users = User.query.filter(User.id != 1).all()
-        for user in users:
-            user.glass_balance += amount
-
+        total_affected = ledger.credit_all(amount, 'admin_grant_all')
         db.session.commit()
+        invalidate_users()
 
         return jsonify({
             'status': 'success',
             'message': f'Выдано {amount} стеклов всем пользователям',
-            'total_affected': len(users)
+            'total_affected': total_affected
+        })
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+
+@app.route('/api/admin/give_glass_batch', methods=['POST'])
+@login_required
+def admin_give_glass_batch():
+    if not is_admin():
+        return jsonify({'status': 'error', 'message': 'Доступ запрещен'})
+
+    try:
+        data = request.get_json()
+        usernames = data.get('usernames') or []
+        amount = int(data.get('amount', 0))
+
+        if amount <= 0:
+            return jsonify({'status': 'error', 'message': 'Неверное количество'})
+
+        found = user_ids_by_username(usernames)
+
+        total_affected = ledger.credit_users(list(found.values()), amount, 'admin_grant_batch')
+        db.session.commit()
+        invalidate_users(found.values())
+
+        return jsonify({
+            'status': 'success',
+            'message': f'Выдано {amount} стеклов {total_affected} пользователям',
+            'total_affected': total_affected,
+            'not_found': [username for username in usernames if username not in found]
         })
 
     except Exception as e:
@@ -453,6 +1150,7 @@ def admin_ban_user():
 
         user.is_banned = True
         db.session.commit()
+        invalidate_users([user.id])
 
         return jsonify({'status': 'success', 'message': f'Пользователь {username} забанен'})
 
@@ -476,6 +1174,7 @@ def admin_unban_user():
 
         user.is_banned = False
         db.session.commit()
+        invalidate_users([user.id])
 
         return jsonify({'status': 'success', 'message': f'Пользователь {username} разбанен'})
 
@@ -500,6 +1199,7 @@ def admin_change_password():
 
         user.set_password(new_password)
         db.session.commit()
+        invalidate_users([user.id])
 
         return jsonify({'status': 'success', 'message': f'Пароль для {username} изменен'})
 
@@ -514,32 +1214,60 @@ def logout():
     return redirect(url_for('index'))
 
 
-# Создание таблиц и начальных данных
-with app.app_context():
-    db.create_all()
+def init_database():
+    # Один раз при развертывании, а не в каждом воркере
+    applied = migrations.upgrade()
+    created = migrations.seed_users()
+    return applied, created
 
-    bot_user = User.query.filter_by(username='GSLASE_Bot').first()
-    if not bot_user:
-        bot_user = User(
-            username='GSLASE_Bot',
-            email='bot@gslase.com',
-            glass_balance=0
-        )
-        bot_user.set_password('bot_password')
-        db.session.add(bot_user)
 
-    admin_user = User.query.filter_by(username='@').first()
-    if not admin_user:
-        admin_user = User(username='@', email='admin@gslase.com')
-        admin_user.set_password('admin123')
-        admin_user.glass_balance = 1000
-        admin_user.is_premium = True
-        db.session.add(admin_user)
+@app.cli.command('init-db')
+def init_db_command():
+    applied, created = init_database()
+    print(f'Применены миграции: {applied}' if applied else 'Схема уже актуальна')
+    if created:
+        print(f'Созданы пользователи: {", ".join(created)}')
 
-    db.session.commit()
 
+@app.cli.command('event-broker')
+def event_broker_command():
+    # Для EVENT_BUS_BACKEND=socket: один брокер на все воркеры этой машины
+    path = socket_path(app)
+    print(f'Брокер событий слушает {path}')
+    EventBroker(path).serve_forever()
 
 
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    applied = migrations.upgrade()
+    print(f'Применены миграции: {applied}' if applied else 'Схема уже актуальна')
+
+
+@app.cli.command('archive-messages')
+@click.option('--days', type=int, default=None, help='Возраст сообщений в днях (по умолчанию MESSAGE_ARCHIVE_DAYS)')
+def archive_messages_command(days):
+    days = app.config['MESSAGE_ARCHIVE_DAYS'] if days is None else days
+    archived = archive.archive_messages(days, app.config['MESSAGE_ARCHIVE_BATCH_SIZE'])
+    print(f'Перенесено в архив сообщений: {archived}')
+
+
+@app.cli.command('usage-report')
+@click.option('--days', type=int, default=None, help='Окно отчета в днях (по умолчанию REPORT_DAYS)')
+def usage_report_command(days):
+    days = app.config['REPORT_DAYS'] if days is None else days
+    report = reports.generate_report(days, app.config['REPORT_CHUNK_SIZE'])
+    print(f'Отчет #{report.id} за {report.days} дн. сохранен')
+
+
+@app.cli.command('backfill-chats')
+def backfill_chats_command():
+    migrations.backfill_chat_summaries()
+    db.session.commit()
+    print('Сводки чатов обновлены')
+
 
 if __name__ == '__main__':
+    # Для локального запуска база готовится здесь же; в развертывании - flask init-db
+    with app.app_context():
+        init_database()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
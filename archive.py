@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select
+from models import db, ArchivedMessage, Chat, Message
+
+# Перенос старых сообщений в архивную базу (bind 'archive'). Горячая таблица
+# message остается небольшой, а пагинация истории дочитывает архив сама
+# (см. paginate_messages в app.py).
+
+COLUMNS = ('id', 'sender_id', 'receiver_id', 'user_low', 'user_high',
+           'content', 'content_type', 'invitation_id', 'timestamp')
+
+
+def archive_boundary(cutoff):
+    # Первый id не старше cutoff. Старые сообщения лежат в начале таблицы,
+    # поэтому просмотр по первичному ключу останавливается быстро.
+    # Сообщение с наибольшим id не архивируется никогда: id - INTEGER PRIMARY
+    # KEY без AUTOINCREMENT, и после его удаления SQLite выдал бы тот же id
+    # новому сообщению, а в архиве он уже занят
+    boundary = db.session.query(Message.id).filter(
+        Message.timestamp >= cutoff
+    ).order_by(Message.id.asc()).limit(1).scalar()
+    if boundary is None:
+        boundary = db.session.query(db.func.max(Message.id)).scalar() or 0
+    return boundary
+
+
+def archive_messages(days, batch_size=500):
+    """Переносит в архив сообщения старше days дней, возвращает их число."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    # Архивируются только id меньше границы: так архив всегда старше
+    # горячей части переписки и пагинация может дочитывать его в конце
+    boundary = archive_boundary(cutoff)
+    # Последние сообщения чатов остаются: на них ссылается сводка чата
+    pinned = select(Chat.last_message_id).where(Chat.last_message_id.isnot(None))
+    columns = [getattr(Message, name) for name in COLUMNS]
+
+    archived = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(*columns).filter(
+            Message.id > last_id,
+            Message.id < boundary,
+            Message.id.notin_(pinned)
+        ).order_by(Message.id.asc()).limit(batch_size).all()
+        if not rows:
+            return archived
+        ids = [row.id for row in rows]
+        now = datetime.utcnow()
+
+        # Сначала запись в архив: при сбое до удаления сообщение окажется в
+        # обеих базах, чтение это переживет, а повторный запуск перезапишет копию
+        db.session.execute(delete(ArchivedMessage).where(ArchivedMessage.id.in_(ids)))
+        db.session.execute(insert(ArchivedMessage), [dict(row._asdict(), archived_at=now) for row in rows])
+        db.session.commit()
+
+        # Чат мог успеть сослаться на сообщение - такие остаются в горячей таблице
+        db.session.execute(delete(Message).where(Message.id.in_(ids), Message.id.notin_(pinned)))
+        db.session.commit()
+
+        archived += len(ids)
+        last_id = ids[-1]
@@ -0,0 +1,360 @@
+"""Асинхронный режим сервера (ASGI).
+
+Маршруты сообщений и чатов (send_message, get_messages, get_user_chats и
+поток событий /api/stream) обслуживаются асинхронно через SQLAlchemy
+asyncio, поэтому открытое соединение не держит поток. Все остальные
+маршруты передаются синхронному Flask-приложению через WSGI-адаптер.
+
+Зависимости: requirements-async.txt. Запуск (схему и начальных
+пользователей один раз создает `flask --app app init-db`):
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+"""
+import math
+from datetime import datetime
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+
+from cache import user_cache
+from compression import choose_encoding, compress
+from serializers import dumps, message_data
+
+from app import (app, chat_cursor_statement, chat_list_etag, chat_list_version_statement,
+                 chat_summaries_update, chats_page, conversation_version_statement, format_sse, merge_message_pages,
+                 lowest_hot_id_statement, message_event, message_page_statement, messages_etag, needs_archive_page,
+                 read_state_changes, user_chats_statement)
+from config import engine_options
+from database import apply_sqlite_pragmas
+from events import AsyncSubscription, bus
+from metrics import RequestStats, async_request_stats, instrument_engine, record_request
+from ratelimit import rate_limiter, RateLimited
+from models import db, ArchivedMessage, Message, User, conversation_key
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def create_engine_for(sync_engine):
+    # Тот же адрес, что у синхронного движка (с путем относительно instance/),
+    # но с асинхронным драйвером
+    url = sync_engine.url.set(drivername=ASYNC_DRIVERS[sync_engine.dialect.name])
+    engine = create_async_engine(url, **engine_options(str(url)))
+    if sync_engine.dialect.name == 'sqlite':
+        pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+        event.listen(engine.sync_engine, 'connect', lambda conn, record: apply_sqlite_pragmas(conn, pragmas))
+    if app.config.get('METRICS_ENABLED', True):
+        instrument_engine(engine.sync_engine)
+    return engine
+
+
+with app.app_context():
+    engine = create_engine_for(db.engine)
+    archive_engine = create_engine_for(db.engines['archive'])
+
+Session = async_sessionmaker(engine, binds={ArchivedMessage: archive_engine}, expire_on_commit=False)
+
+
+def json_response(content, request=None, status_code=200):
+    # Тот же сериализатор и то же сжатие, что у Flask-маршрутов
+    body = dumps(content)
+    headers = {}
+    if request is not None and app.config['COMPRESSION_ENABLED'] and len(body) >= app.config['COMPRESS_MIN_SIZE']:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = choose_encoding(request.headers.get('accept-encoding'))
+        if encoding:
+            body = compress(body, encoding, app.config)
+            headers['Content-Encoding'] = encoding
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+
+def error(message, status_code=200):
+    return json_response({'status': 'error', 'message': message}, status_code=status_code)
+
+
+async def current_user_id(request):
+    # Та же подписанная cookie сессии Flask, что и у синхронных маршрутов
+    cookie = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return None
+    user_id = data.get('_user_id')
+    if not user_id:
+        return None
+    # Как user_loader: пользователь должен существовать (удаленный теряет
+    # доступ), между запросами он берется из общего кэша
+    user_id = int(user_id)
+    if user_cache.get(user_id) is None:
+        async with Session() as session:
+            user = await session.get(User, user_id)
+        if user is None:
+            return None
+        user_cache.set(user_id, user)
+    return user_id
+
+
+def measured(handler):
+    # Метрики асинхронных маршрутов - в тех же гистограммах /metrics, что и у
+    # Flask (init_metrics), с именем обработчика в качестве endpoint
+    if not app.config.get('METRICS_ENABLED', True):
+        return handler
+
+    @wraps(handler)
+    async def wrapper(request):
+        stats = RequestStats(handler.__name__, app.config['SLOW_QUERY_MS'])
+        token = async_request_stats.set(stats)
+        try:
+            response = await handler(request)
+        finally:
+            async_request_stats.reset(token)
+        # У потоковых ответов (SSE) размер заранее неизвестен
+        size = None if isinstance(response, StreamingResponse) else len(response.body)
+        record_request(app.config, stats, request.method, request.url.path, size)
+        return response
+    return wrapper
+
+
+def login_required(handler):
+    @wraps(handler)
+    async def wrapper(request):
+        user_id = await current_user_id(request)
+        if user_id is None:
+            return error('Требуется вход', 401)
+        request.state.user_id = user_id
+        return await handler(request)
+    return wrapper
+
+
+def rate_limited(name):
+    # Тот же лимитер и те же ключи, что у декоратора Flask-маршрутов.
+    # SQLite-бэкенд ждет блокировку файла, поэтому он вызывается в пуле
+    # потоков, чтобы не останавливать цикл событий
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            key = f'user:{request.state.user_id}'
+            try:
+                if rate_limiter.backend.blocking:
+                    await run_in_threadpool(rate_limiter.hit, name, key)
+                else:
+                    rate_limiter.hit(name, key)
+            except RateLimited as e:
+                response = error('Слишком много запросов, попробуйте позже', 429)
+                response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+                return response
+            return await handler(request)
+        return wrapper
+    return decorator
+
+
+def conditional_response(request, etag, build):
+    # 304 без построения тела, если у клиента уже есть эта версия.
+    # ETag всегда слабый, как в conditional_response приложения Flask
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        response = Response(status_code=304)
+    else:
+        response = build()
+    response.headers['ETag'] = 'W/' + quote_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def page_args(request, prefix='MESSAGES'):
+    def int_arg(name, default=None):
+        try:
+            return int(request.query_params[name])
+        except (KeyError, ValueError):
+            return default
+
+    limit = int_arg('limit', app.config[f'{prefix}_PAGE_SIZE'])
+    limit = max(1, min(limit, app.config[f'{prefix}_PAGE_SIZE_MAX']))
+    return int_arg('before_id'), int_arg('after_id'), limit
+
+
+@measured
+@login_required
+@rate_limited('send_message')
+async def send_message(request):
+    try:
+        data = await request.json()
+        content = (data.get('content') or '').strip()
+        sender_id = request.state.user_id
+        try:
+            receiver_id = int(data.get('receiver_id'))
+        except (TypeError, ValueError):
+            return error('Не указан получатель')
+
+        if not content:
+            return error('Сообщение не может быть пустым')
+
+        row = {
+            'sender_id': sender_id,
+            'receiver_id': receiver_id,
+            'content': content,
+            'content_type': 'text',
+            'timestamp': datetime.utcnow()
+        }
+        row['user_low'], row['user_high'] = conversation_key(sender_id, receiver_id)
+
+        # Групповой commit (MESSAGE_BATCHING) работает на потоках и здесь не
+        # используется: одна транзакция на сообщение без блокировки цикла событий
+        async with Session() as session, session.begin():
+            users = {user.id: user for user in await session.scalars(
+                select(User).where(User.id.in_([sender_id, receiver_id])))}
+            if receiver_id not in users:
+                return error('Получатель не найден')
+            message_id = await session.scalar(insert(Message).values(row).returning(Message.id))
+            msg = Message(id=message_id, **row)
+            await session.execute(*chat_summaries_update(
+                {(row['user_low'], row['user_high']): msg}, read_state_changes([msg])))
+
+        msg.sender = users.get(sender_id)
+        msg.receiver = users.get(receiver_id)
+        for user_id in {sender_id, receiver_id}:
+            if user_id is not None:
+                bus.publish(user_id, message_event(msg, user_id))
+
+        return json_response({
+            'status': 'success',
+            'message': {
+                'id': message_id,
+                'content': content,
+                'sender': msg.sender.username if msg.sender else 'Unknown',
+                'timestamp': row['timestamp']
+            }
+        })
+
+    except Exception as e:
+        return error(str(e))
+
+
+@measured
+@login_required
+async def get_messages(request):
+    try:
+        user_id = request.state.user_id
+        receiver_id = request.path_params['receiver_id']
+        before_id, after_id, limit = page_args(request)
+
+        def condition(model):
+            return model.between(user_id, receiver_id)
+
+        async with Session() as session:
+            version = await session.scalar(conversation_version_statement(user_id, receiver_id)) or 0
+            etag = messages_etag(user_id, receiver_id, version, before_id, after_id, limit)
+            if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                return conditional_response(request, etag, None)
+
+            rows = (await session.scalars(
+                message_page_statement(Message, condition, before_id, after_id, limit))).all()
+            lowest_hot_id = None
+            if after_id is not None:
+                lowest_hot_id = await session.scalar(lowest_hot_id_statement(condition))
+            archived = []
+            if needs_archive_page(rows, after_id, limit, lowest_hot_id):
+                archived = (await session.scalars(
+                    message_page_statement(ArchivedMessage, condition, before_id, after_id, limit))).all()
+            messages, has_more = merge_message_pages(rows, archived, after_id, limit)
+
+        return conditional_response(request, etag, lambda: json_response({
+            'status': 'success',
+            'messages': [message_data(msg, user_id) for msg in messages],
+            'has_more': has_more
+        }, request))
+
+    except Exception as e:
+        return error(str(e))
+
+
+@measured
+@login_required
+async def get_user_chats(request):
+    try:
+        user_id = request.state.user_id
+        before_id, _, limit = page_args(request, 'CHATS')
+        async with Session() as session:
+            version = (await session.execute(chat_list_version_statement(user_id))).one()
+            etag = chat_list_etag(user_id, version, before_id, limit)
+            if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                return conditional_response(request, etag, None)
+            cursor = None
+            if before_id is not None:
+                cursor = (await session.execute(chat_cursor_statement(user_id, before_id))).first()
+                if cursor is None:
+                    return error('Чат не найден')
+            rows = (await session.execute(user_chats_statement(user_id, cursor, limit))).all()
+
+        return conditional_response(request, etag, lambda: json_response(chats_page(rows, limit), request))
+
+    except Exception as e:
+        return error(str(e))
+
+
+@measured
+@login_required
+async def stream_events(request):
+    user_id = request.state.user_id
+    try:
+        since = int(request.headers.get('last-event-id') or request.query_params.get('since') or 0)
+    except ValueError:
+        since = 0
+
+    # Подписываемся до чтения пропущенных сообщений, чтобы ничего не потерять
+    subscription = bus.subscribe(user_id, AsyncSubscription(user_id))
+    backlog = []
+    if since:
+        async with Session() as session:
+            missed = await session.scalars(select(Message).where(
+                Message.of_user(user_id), Message.id > since
+            ).options(
+                selectinload(Message.sender), selectinload(Message.receiver)
+            ).order_by(Message.id.asc()).limit(app.config['STREAM_BACKLOG_LIMIT']))
+            backlog = [message_event(msg, user_id) for msg in missed]
+
+    keepalive = app.config['STREAM_KEEPALIVE']
+
+    async def generate():
+        # Как в stream_events: отсеиваются только уже отправленные из backlog
+        sent_ids = {item['message']['id'] for item in backlog}
+        try:
+            yield 'retry: 3000\n\n'
+            for item in backlog:
+                yield format_sse(item)
+
+            while True:
+                item = await subscription.get(timeout=keepalive)
+                if item is None:
+                    yield ': keepalive\n\n'
+                    continue
+                if 'message' in item and item['message']['id'] in sent_ids:
+                    continue
+                yield format_sse(item)
+        finally:
+            bus.unsubscribe(subscription)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+application = Starlette(routes=[
+    Route('/api/send_message', send_message, methods=['POST']),
+    Route('/api/messages/{receiver_id:int}', get_messages),
+    Route('/api/user_chats', get_user_chats),
+    Route('/api/stream', stream_events),
+    Mount('/', app=WSGIMiddleware(app)),
+])
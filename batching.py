@@ -0,0 +1,71 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriteBatcher:
+    """Групповой commit: копит записи и сбрасывает их одной транзакцией.
+
+    Пачка уходит в базу, когда набралось max_batch записей или прошло
+    max_delay секунд с первой записи в пачке. flush(rows) выполняется в
+    фоновом потоке внутри контекста приложения и возвращает по результату
+    на каждую запись; каждый вызов submit() ждет commit своей пачки.
+    """
+
+    def __init__(self, app, flush, max_batch=100, max_delay=0.005):
+        self.app = app
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, row, timeout=None):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((row, future))
+        return future.result(timeout=timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        try:
+            results = self._flush([row for row, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Одна плохая запись не должна ронять всю пачку: повторяем по одной
+            for item in batch:
+                self._flush_batch([item])
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _flush(self, rows):
+        # При ошибке teardown контекста откатывает сессию
+        with self.app.app_context():
+            return self.flush(rows)
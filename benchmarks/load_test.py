@@ -0,0 +1,326 @@
+"""Нагрузочный прогон HTTP API на синтетических данных.
+
+Создает временную базу, заполняет ее пользователями, чатами, сообщениями и
+приглашениями, затем параллельно гоняет реальные маршруты приложения
+(через Flask test client или локальный сервер) и печатает JSON с
+p50/p95/p99, пропускной способностью и числом SQL-запросов по маршрутам.
+
+Запуск (из корня репозитория):
+    python benchmarks/load_test.py --users 1000 --messages 100000 --workers 16 --duration 30
+    python benchmarks/load_test.py --mode server --output results.json
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'load-test-password'
+DEFAULT_MIX = 'send_message=2,messages=4,user_chats=2,search_users=1,main=1'
+_local = threading.local()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--chats-per-user', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--invitations', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=8, help='параллельных клиентов')
+    parser.add_argument('--duration', type=float, default=20, help='секунд нагрузки')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='веса маршрутов, например send_message=2,messages=4')
+    parser.add_argument('--mode', choices=('client', 'server'), default='client')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='путь к файлу базы (по умолчанию временный)')
+    parser.add_argument('--output', help='куда записать JSON (по умолчанию stdout)')
+    return parser.parse_args()
+
+
+def load_app(path):
+    # Приложение читает DATABASE_URL при импорте, поэтому импортируем после настройки окружения.
+    # Лимиты частоты запросов отключены: все клиенты приходят с одного адреса
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    import app as application
+    with application.app.app_context():
+        application.init_database()
+    return application
+
+
+def seed(application, args, rng):
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    from models import db, User, Chat, Message, Invitation, conversation_key
+    import migrations
+
+    app = application.app
+    with app.app_context():
+        password_hash = generate_password_hash(PASSWORD)
+        first_id = db.session.query(db.func.max(User.id)).scalar() + 1
+        now = datetime.utcnow()
+        db.session.execute(insert(User), [{
+            'id': first_id + i,
+            'username': f'load_user_{i}',
+            'email': f'load_user_{i}@example.com',
+            'password_hash': password_hash,
+            'glass_balance': 100,
+            'created_at': now,
+        } for i in range(args.users)])
+        user_ids = list(range(first_id, first_id + args.users))
+
+        pairs = set()
+        for user_id in user_ids:
+            for peer in rng.sample(user_ids, min(args.chats_per_user, len(user_ids) - 1)):
+                if peer != user_id:
+                    pairs.add(conversation_key(user_id, peer))
+        pairs = sorted(pairs)
+        db.session.execute(insert(Chat), [{
+            'user1_id': low, 'user2_id': high, 'user_low': low, 'user_high': high, 'created_at': now
+        } for low, high in pairs])
+
+        start = now - timedelta(seconds=args.messages)
+        for offset in range(0, args.messages, 50_000):
+            rows = []
+            for i in range(offset, min(offset + 50_000, args.messages)):
+                low, high = rng.choice(pairs)
+                sender, receiver = (low, high) if rng.random() < 0.5 else (high, low)
+                rows.append({
+                    'sender_id': sender, 'receiver_id': receiver, 'user_low': low, 'user_high': high,
+                    'content': f'message {i}', 'content_type': 'text', 'timestamp': start + timedelta(seconds=i)
+                })
+            db.session.execute(insert(Message), rows)
+
+        db.session.execute(insert(Invitation), [{
+            'inviter_id': rng.choice(user_ids), 'invited_user_id': rng.choice(user_ids),
+            'channel_name': 'load-test', 'status': rng.choice(('pending', 'accepted', 'rejected')),
+            'created_at': now
+        } for _ in range(args.invitations)])
+
+        migrations.backfill_chat_summaries()
+        db.session.commit()
+
+    peers = defaultdict(list)
+    for low, high in pairs:
+        peers[low].append(high)
+        peers[high].append(low)
+    return user_ids, peers
+
+
+def install_query_counter(application):
+    # Счетчик SQL на запрос отдается заголовком, так он доступен и через HTTP
+    from sqlalchemy import event
+    from models import db
+
+    app = application.app
+
+    def count(*args):
+        _local.queries = getattr(_local, 'queries', 0) + 1
+
+    @app.before_request
+    def reset_query_count():
+        _local.queries = 0
+
+    @app.after_request
+    def report_query_count(response):
+        response.headers['X-Query-Count'] = str(getattr(_local, 'queries', 0))
+        return response
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, url):
+        return self._result(self.client.get(url))
+
+    def post(self, url, data=None, json_body=None):
+        return self._result(self.client.post(url, data=data, json=json_body))
+
+    @staticmethod
+    def _result(response):
+        return response.status_code, len(response.data), int(response.headers.get('X-Query-Count', 0))
+
+
+class HttpSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect
+        )
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request) as response:
+                return response.status, len(response.read()), int(response.headers.get('X-Query-Count', 0))
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read()), int(e.headers.get('X-Query-Count', 0))
+
+    def get(self, url):
+        return self._open(urllib.request.Request(self.base_url + url))
+
+    def post(self, url, data=None, json_body=None):
+        if json_body is not None:
+            body, content_type = json.dumps(json_body).encode(), 'application/json'
+        else:
+            body, content_type = urllib.parse.urlencode(data or {}).encode(), 'application/x-www-form-urlencoded'
+        return self._open(urllib.request.Request(
+            self.base_url + url, data=body, headers={'Content-Type': content_type}
+        ))
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def make_requests(user_id, peers, rng):
+    # Маршрут -> функция, выполняющая один запрос от имени user_id
+    def send_message(session):
+        return session.post('/api/send_message', json_body={
+            'content': 'load test', 'receiver_id': rng.choice(peers[user_id])
+        })
+
+    def messages(session):
+        return session.get(f'/api/messages/{rng.choice(peers[user_id])}')
+
+    def user_chats(session):
+        return session.get('/api/user_chats')
+
+    def search_users(session):
+        return session.get(f'/api/search_users?q=load_user_{rng.randint(0, 99)}')
+
+    def main_page(session):
+        return session.get('/main')
+
+    return {
+        'send_message': send_message,
+        'messages': messages,
+        'user_chats': user_chats,
+        'search_users': search_users,
+        'main': main_page,
+    }
+
+
+def worker(session_factory, username, user_id, peers, mix, deadline, seed, results):
+    rng = random.Random(seed)
+    session = session_factory()
+    session.post('/login', data={'username': username, 'password': PASSWORD})
+    requests = make_requests(user_id, peers, rng)
+    names = [name for name, weight in mix for _ in range(weight)]
+
+    while time.monotonic() < deadline:
+        name = rng.choice(names)
+        started = time.perf_counter()
+        status, size, queries = requests[name](session)
+        elapsed = time.perf_counter() - started
+        results.append((name, elapsed, queries, status, size))
+
+
+def summarize(results, elapsed):
+    by_route = defaultdict(list)
+    for row in results:
+        by_route[row[0]].append(row)
+
+    def percentile(values, q):
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    report = {}
+    for name, rows in sorted(by_route.items()):
+        latencies = sorted(row[1] * 1000 for row in rows)
+        report[name] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[3] >= 400),
+            'throughput_rps': round(len(rows) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_queries': round(statistics.mean(row[2] for row in rows), 2),
+            'mean_response_bytes': round(statistics.mean(row[4] for row in rows)),
+        }
+    return report
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    mix = [(name, int(weight)) for name, weight in (item.split('=') for item in args.mix.split(','))]
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'load_test.db')
+    if os.path.exists(path):
+        os.remove(path)
+
+    application = load_app(path)
+    print(f'Seeding {path} ...', file=sys.stderr)
+    started = time.perf_counter()
+    user_ids, peers = seed(application, args, rng)
+    seed_seconds = time.perf_counter() - started
+    install_query_counter(application)
+
+    server = None
+    if args.mode == 'server':
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, application.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.port}'
+
+        def session_factory():
+            return HttpSession(base_url)
+    else:
+        def session_factory():
+            return TestClientSession(application.app)
+
+    results = []
+    candidates = [index for index, user_id in enumerate(user_ids) if peers[user_id]]
+    deadline = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(
+            session_factory, f'load_user_{index}', user_ids[index], peers, mix, deadline, args.seed + n, results
+        ))
+        for n, index in enumerate(rng.sample(candidates, min(args.workers, len(candidates))))
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if server is not None:
+        server.shutdown()
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('db', 'output')},
+        'seed_seconds': round(seed_seconds, 2),
+        'duration_seconds': round(elapsed, 2),
+        'total_requests': len(results),
+        'total_throughput_rps': round(len(results) / elapsed, 1),
+        'endpoints': summarize(results, elapsed),
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
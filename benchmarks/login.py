@@ -0,0 +1,93 @@
+"""Пропускная способность /login при заданной стоимости хеширования паролей.
+
+Параллельные клиенты многократно входят в систему; печатается JSON с
+числом входов в секунду, p50/p95/p99 и долей отказов 503 (очередь
+хеширования заполнена). Помогает подобрать PASSWORD_HASH_METHOD,
+PASSWORD_HASH_WORKERS и PASSWORD_HASH_QUEUE под пиковую нагрузку.
+
+Запуск (из корня репозитория):
+    python benchmarks/login.py --method pbkdf2:sha256:600000 --clients 32 --logins 20
+    python benchmarks/login.py --method scrypt:32768:8:1 --hash-workers 4 --hash-queue 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'benchmark-password'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--method', default='pbkdf2:sha256:600000', help='PASSWORD_HASH_METHOD')
+    parser.add_argument('--hash-workers', type=int, default=os.cpu_count() or 1, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--hash-queue', type=int, default=64, help='PASSWORD_HASH_QUEUE')
+    parser.add_argument('--clients', type=int, default=16, help='одновременных клиентов')
+    parser.add_argument('--logins', type=int, default=10, help='входов на клиента')
+    args = parser.parse_args()
+
+    # Конфигурация читается при импорте приложения
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'login.db')}"
+    os.environ['PASSWORD_HASH_METHOD'] = args.method
+    os.environ['PASSWORD_HASH_WORKERS'] = str(args.hash_workers)
+    os.environ['PASSWORD_HASH_QUEUE'] = str(args.hash_queue)
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    import app as application
+    from models import db, User
+
+    app = application.app
+    with app.app_context():
+        application.init_database()
+        users = []
+        for i in range(args.clients):
+            user = User(username=f'login_user_{i}', email=f'login_user_{i}@example.com')
+            user.set_password(PASSWORD)
+            users.append(user)
+        db.session.add_all(users)
+        db.session.commit()
+
+    results = []
+    lock = threading.Lock()
+
+    def client(i):
+        for _ in range(args.logins):
+            test_client = app.test_client()
+            started = time.perf_counter()
+            response = test_client.post('/login', data={'username': f'login_user_{i}', 'password': PASSWORD})
+            elapsed = time.perf_counter() - started
+            with lock:
+                results.append((elapsed, response.status_code))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+
+    ok = sorted(elapsed * 1000 for elapsed, status in results if status == 302)
+    rejected = sum(1 for _, status in results if status == 503)
+
+    def percentile(q):
+        return round(ok[min(len(ok) - 1, int(len(ok) * q))], 2) if ok else None
+
+    print(json.dumps({
+        'config': vars(args),
+        'logins': len(results),
+        'successful': len(ok),
+        'rejected_503': rejected,
+        'logins_per_second': round(len(ok) / total, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""Проверка согласованности нескольких воркеров: шина событий и кэш.
+
+Запускает N процессов приложения (flask run) на общей базе и, при
+--backend socket, брокер событий (flask event-broker). Затем проверяет:
+
+  * сообщения: алиса отправляет сообщение через каждый воркер по очереди,
+    у боба открыт поток /api/stream на каждом воркере - каждое сообщение
+    должно прийти в каждый поток ровно один раз;
+  * одновременные сообщения: то же, но в каждом раунде все воркеры
+    принимают по --senders сообщений одновременно. События чужих воркеров
+    приходят через брокер позже локальных, то есть не по порядку id, и
+    поток не должен их терять;
+  * кэш пользователей: администратор выдает бобу стеклы через один воркер,
+    а баланс на /main у всех воркеров должен обновиться (без сброса кэша
+    user_loader воркер показывал бы старое значение до USER_CACHE_TTL).
+
+Печатает JSON с задержкой распространения (p50/p95/max) и числом ошибок;
+код возврата 1, если хотя бы одна проверка не прошла. С --backend local
+видно, как ведут себя воркеры без общей шины.
+
+Запуск (из корня репозитория):
+    python benchmarks/multiworker.py --workers 4 --rounds 10 --senders 3
+    python benchmarks/multiworker.py --backend local --timeout 2
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'multiworker-password'
+BALANCE = re.compile(r'🪙 (\d+)')
+
+
+class Session:
+    """Клиент с cookie-сессией; cookie подписана общим SECRET_KEY, поэтому
+    одна сессия работает с любым воркером."""
+
+    def __init__(self):
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, url, data=None, json_body=None, stream=False):
+        headers = {}
+        if json_body is not None:
+            data, headers['Content-Type'] = json.dumps(json_body).encode(), 'application/json'
+        elif data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        response = self.opener.open(urllib.request.Request(url, data=data, headers=headers), timeout=30)
+        if stream:
+            return response
+        with response:
+            return response.read().decode()
+
+
+class Stream:
+    """Поток /api/stream одного воркера: запоминает время прихода сообщений."""
+
+    def __init__(self, session, base_url):
+        self.received = {}
+        self.duplicates = 0
+        self.ready = threading.Event()
+        self._condition = threading.Condition()
+        self._response = session.request(f'{base_url}/api/stream', stream=True)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self._response:
+            line = line.decode().strip()
+            if line.startswith('retry:'):
+                self.ready.set()
+            if not line.startswith('data:'):
+                continue
+            event = json.loads(line[5:])
+            if 'message' not in event:
+                continue
+            content = event['message']['content']
+            with self._condition:
+                if content in self.received:
+                    self.duplicates += 1
+                else:
+                    self.received[content] = time.perf_counter()
+                self._condition.notify_all()
+
+    def wait_for(self, content, deadline):
+        with self._condition:
+            while content not in self.received:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self.received[content]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def flask(*args, env, **kwargs):
+    return [sys.executable, '-m', 'flask', '--app', 'app', *args], dict(cwd=ROOT, env=env, **kwargs)
+
+
+def wait_until(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except (OSError, urllib.error.URLError):
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'{what}: не дождались за {timeout} с')
+
+
+def login(base_url, username, register=False):
+    session = Session()
+    if register:
+        session.request(f'{base_url}/register', data={
+            'username': username, 'email': f'{username}@example.com',
+            'password': PASSWORD, 'confirm_password': PASSWORD
+        })
+    session.request(f'{base_url}/login', data={
+        'username': username, 'password': 'admin123' if username == '@' else PASSWORD
+    })
+    return session
+
+
+def latency(values):
+    if not values:
+        return None
+    values = sorted(value * 1000 for value in values)
+    return {
+        'p50': round(statistics.median(values), 2),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+        'max': round(values[-1], 2),
+    }
+
+
+def check_messages(alice, bob_id, urls, streams, rounds, timeout):
+    latencies, missing = [], 0
+    for round_number in range(rounds):
+        for sender, url in enumerate(urls):
+            content = f'multiworker {round_number}.{sender} {uuid.uuid4().hex}'
+            started = time.perf_counter()
+            alice.request(f'{url}/api/send_message', json_body={'receiver_id': bob_id, 'content': content})
+            deadline = started + timeout
+            for stream in streams:
+                received = stream.wait_for(content, deadline)
+                if received is None:
+                    missing += 1
+                else:
+                    latencies.append(received - started)
+    return {
+        'checks': rounds * len(urls) * len(streams),
+        'missing': missing,
+        'duplicates': sum(stream.duplicates for stream in streams),
+        'latency_ms': latency(latencies),
+    }
+
+
+def check_concurrent_messages(alice, bob_id, urls, streams, rounds, senders, timeout):
+    latencies, missing, failed = [], 0, []
+    duplicates_before = sum(stream.duplicates for stream in streams)
+    for round_number in range(rounds):
+        contents = [(url, f'concurrent {round_number}.{worker}.{sender} {uuid.uuid4().hex}')
+                    for worker, url in enumerate(urls) for sender in range(senders)]
+        barrier = threading.Barrier(len(contents))
+
+        def send(url, content):
+            barrier.wait()
+            try:
+                alice.request(f'{url}/api/send_message', json_body={'receiver_id': bob_id, 'content': content})
+            except (OSError, urllib.error.URLError) as e:
+                failed.append(str(e))
+
+        threads = [threading.Thread(target=send, args=item) for item in contents]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        deadline = time.perf_counter() + timeout
+        for _, content in contents:
+            for stream in streams:
+                received = stream.wait_for(content, deadline)
+                if received is None:
+                    missing += 1
+                else:
+                    latencies.append(received - started)
+    return {
+        'checks': rounds * len(urls) * senders * len(streams),
+        'missing': missing,
+        'duplicates': sum(stream.duplicates for stream in streams) - duplicates_before,
+        'send_errors': len(failed),
+        'latency_ms': latency(latencies),
+    }
+
+
+def check_user_cache(admin, bob, urls, rounds, timeout):
+    latencies, stale = [], 0
+
+    def balance(url):
+        return int(BALANCE.search(bob.request(f'{url}/main')).group(1))
+
+    for round_number in range(rounds):
+        # Каждый воркер держит боба в кэше user_loader
+        expected = max(balance(url) for url in urls) + 1
+        writer = urls[round_number % len(urls)]
+        started = time.perf_counter()
+        admin.request(f'{writer}/api/admin/give_glass', json_body={'username': 'bob', 'amount': 1})
+        deadline = started + timeout
+        for url in urls:
+            while balance(url) != expected:
+                if time.perf_counter() > deadline:
+                    stale += 1
+                    break
+                time.sleep(0.005)
+            else:
+                latencies.append(time.perf_counter() - started)
+    return {
+        'checks': rounds * len(urls),
+        'stale': stale,
+        'latency_ms': latency(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--senders', type=int, default=2, help='одновременных отправок на воркер')
+    parser.add_argument('--backend', choices=('socket', 'local'), default='socket', help='EVENT_BUS_BACKEND')
+    parser.add_argument('--timeout', type=float, default=5, help='секунд ожидания распространения')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(directory, 'multiworker.db')}",
+        EVENT_BUS_BACKEND=args.backend,
+        EVENT_BUS_SOCKET=os.path.join(directory, 'events.sock'),
+        RATE_LIMIT_ENABLED='0',
+    )
+    command, options = flask('init-db', env=env, stdout=subprocess.DEVNULL, check=True)
+    subprocess.run(command, **options)
+
+    processes = []
+    try:
+        if args.backend == 'socket':
+            command, options = flask('event-broker', env=env, stdout=subprocess.DEVNULL)
+            processes.append(subprocess.Popen(command, **options))
+            wait_until(lambda: os.path.exists(env['EVENT_BUS_SOCKET']), 30, 'брокер событий')
+
+        urls = []
+        for _ in range(args.workers):
+            port = free_port()
+            command, options = flask('run', '--port', str(port), '--no-reload', '--no-debugger', env=env,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(subprocess.Popen(command, **options))
+            urls.append(f'http://127.0.0.1:{port}')
+        for url in urls:
+            wait_until(lambda: urllib.request.urlopen(f'{url}/login', timeout=1).status == 200, 30, url)
+
+        alice = login(urls[0], 'alice', register=True)
+        bob = login(urls[0], 'bob', register=True)
+        admin = login(urls[0], '@')
+        bob_id = json.loads(alice.request(f'{urls[0]}/api/search_users?q=bob'))['users'][0]['id']
+        alice.request(f'{urls[0]}/api/create_chat', json_body={'receiver_id': bob_id})
+
+        streams = [Stream(bob, url) for url in urls]
+        for stream in streams:
+            stream.ready.wait(10)
+        # Воркеры подключаются к брокеру в фоне при первом запросе
+        time.sleep(0.5)
+
+        messages = check_messages(alice, bob_id, urls, streams, args.rounds, args.timeout)
+        concurrent = check_concurrent_messages(alice, bob_id, urls, streams, args.rounds, args.senders, args.timeout)
+        user_cache = check_user_cache(admin, bob, urls, args.rounds, args.timeout)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    ok = not (messages['missing'] or messages['duplicates'] or user_cache['stale']
+              or concurrent['missing'] or concurrent['duplicates'] or concurrent['send_errors'])
+    print(json.dumps({
+        'config': vars(args),
+        'messages': messages,
+        'concurrent_messages': concurrent,
+        'user_cache': user_cache,
+        'ok': ok,
+    }, indent=2, ensure_ascii=False))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""Планы и время горячих запросов до и после миграций индексов.
+
+Запуск (из корня репозитория):
+    python benchmarks/query_plans.py --messages 10000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from config import archive_database_uri  # noqa: E402
+from database import init_db  # noqa: E402
+import migrations  # noqa: E402
+
+# Схема до миграций (как ее создавал db.create_all() в исходной версии)
+BASELINE_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER PRIMARY KEY, username VARCHAR(64) NOT NULL UNIQUE, email VARCHAR(120) NOT NULL UNIQUE,
+    password_hash VARCHAR(256), avatar_url VARCHAR(256), glass_balance INTEGER, is_premium BOOLEAN,
+    created_at DATETIME, is_banned BOOLEAN
+);
+CREATE TABLE chat (
+    id INTEGER PRIMARY KEY, user1_id INTEGER NOT NULL REFERENCES user (id),
+    user2_id INTEGER NOT NULL REFERENCES user (id), created_at DATETIME
+);
+CREATE TABLE invitation (
+    id INTEGER PRIMARY KEY, inviter_id INTEGER NOT NULL REFERENCES user (id),
+    invited_user_id INTEGER NOT NULL REFERENCES user (id), channel_name VARCHAR(100) NOT NULL,
+    status VARCHAR(20), created_at DATETIME
+);
+CREATE TABLE message (
+    id INTEGER PRIMARY KEY, sender_id INTEGER NOT NULL REFERENCES user (id),
+    receiver_id INTEGER REFERENCES user (id), content TEXT NOT NULL, content_type VARCHAR(20),
+    invitation_id INTEGER REFERENCES invitation (id), timestamp DATETIME
+);
+"""
+
+# Одни и те же логические запросы до и после: различаются только колонками,
+# по которым их можно выразить, поэтому разница во времени - это индексы
+QUERIES_BEFORE = {
+    'conversation page': (
+        'SELECT * FROM message WHERE (sender_id = :a AND receiver_id = :b) OR (sender_id = :b AND receiver_id = :a) '
+        'ORDER BY id DESC LIMIT 50'
+    ),
+    'chat lookup': (
+        'SELECT * FROM chat WHERE (user1_id = :a AND user2_id = :b) OR (user1_id = :b AND user2_id = :a) LIMIT 1'
+    ),
+    'user chats': 'SELECT * FROM chat WHERE user1_id = :a OR user2_id = :a',
+    'user messages': (
+        'SELECT * FROM message WHERE receiver_id = :a OR sender_id = :a ORDER BY id DESC LIMIT 50'
+    ),
+    'pending invitations': "SELECT * FROM invitation WHERE invited_user_id = :a AND status = 'pending'",
+}
+
+QUERIES_AFTER = {
+    'conversation page': (
+        'SELECT * FROM message WHERE user_low = :low AND user_high = :high ORDER BY id DESC LIMIT 50'
+    ),
+    'chat lookup': 'SELECT * FROM chat WHERE user_low = :low AND user_high = :high LIMIT 1',
+    'user chats': 'SELECT * FROM chat WHERE user_low = :a OR user_high = :a',
+    'user messages': QUERIES_BEFORE['user messages'],
+    'pending invitations': QUERIES_BEFORE['pending invitations'],
+}
+
+
+def seed(path, users, messages, chats, invitations, chunk=100_000):
+    conn = sqlite3.connect(path)
+    conn.executescript('PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;' + BASELINE_SCHEMA)
+    now = datetime.utcnow()
+    conn.executemany(
+        'INSERT INTO user (id, username, email, glass_balance, is_premium, created_at, is_banned) '
+        'VALUES (?, ?, ?, 100, 0, ?, 0)',
+        ((i, f'user{i}', f'user{i}@example.com', now) for i in range(1, users + 1))
+    )
+
+    rng = random.Random(42)
+    pairs = []
+    for chat_id in range(1, chats + 1):
+        a, b = rng.sample(range(2, users + 1), 2)
+        pairs.append((a, b))
+    conn.executemany(
+        'INSERT INTO chat (id, user1_id, user2_id, created_at) VALUES (?, ?, ?, ?)',
+        ((i + 1, a, b, now) for i, (a, b) in enumerate(pairs))
+    )
+    conn.executemany(
+        'INSERT INTO invitation (inviter_id, invited_user_id, channel_name, status, created_at) '
+        'VALUES (?, ?, ?, ?, ?)',
+        ((rng.randint(2, users), rng.randint(2, users), 'channel', rng.choice(('pending', 'accepted')), now)
+         for _ in range(invitations))
+    )
+
+    start = now - timedelta(seconds=messages)
+    for offset in range(0, messages, chunk):
+        rows = []
+        for i in range(offset, min(offset + chunk, messages)):
+            a, b = pairs[rng.randrange(len(pairs))]
+            if rng.random() < 0.5:
+                a, b = b, a
+            rows.append((a, b, 'hello', 'text', start + timedelta(seconds=i)))
+        conn.executemany(
+            'INSERT INTO message (sender_id, receiver_id, content, content_type, timestamp) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        conn.commit()
+        print(f'  seeded {min(offset + chunk, messages):,} / {messages:,} messages', file=sys.stderr)
+    conn.commit()
+    conn.close()
+    return pairs
+
+
+def measure(conn, queries, samples, repeat):
+    results = {}
+    for name, sql in queries.items():
+        a, b = samples[0]
+        params = {'a': a, 'b': b, 'low': min(a, b), 'high': max(a, b)}
+        plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        timings = []
+        for a, b in samples[:repeat]:
+            params = {'a': a, 'b': b, 'low': min(a, b), 'high': max(a, b)}
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {'plan': plan, 'median_ms': statistics.median(timings)}
+    return results
+
+
+def report(title, results):
+    print(f'\n=== {title} ===')
+    for name, result in results.items():
+        print(f"{name}: {result['median_ms']:.3f} ms (median)")
+        for step in result['plan']:
+            print(f'    {step}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10_000_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--chats', type=int, default=200_000)
+    parser.add_argument('--invitations', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20, help='сколько разных пар пользователей замерять')
+    parser.add_argument('--db', help='путь к файлу базы (по умолчанию временный)')
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if os.path.exists(path):
+        os.remove(path)
+
+    print(f'Seeding {path} ...', file=sys.stderr)
+    pairs = seed(path, args.users, args.messages, args.chats, args.invitations)
+    samples = random.Random(7).sample(pairs, min(args.repeat, len(pairs)))
+
+    conn = sqlite3.connect(path)
+    conn.execute('ANALYZE')
+    report('before migrations', measure(conn, QUERIES_BEFORE, samples, args.repeat))
+    conn.close()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_BINDS'] = {'archive': archive_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])}
+    init_db(app)
+    with app.app_context():
+        started = time.perf_counter()
+        applied = migrations.upgrade()
+        print(f'\nmigrations {applied} applied in {time.perf_counter() - started:.1f} s')
+
+    conn = sqlite3.connect(path)
+    conn.execute('ANALYZE')
+    report('after migrations', measure(conn, QUERIES_AFTER, samples, args.repeat))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Время поиска пользователей: ILIKE '%q%' против индексов из search.py.
+
+Запуск (из корня репозитория):
+    python benchmarks/search_users.py --users 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from config import archive_database_uri  # noqa: E402
+from database import init_db  # noqa: E402
+from models import User  # noqa: E402
+from query_plans import BASELINE_SCHEMA  # noqa: E402
+import migrations  # noqa: E402
+import search  # noqa: E402
+
+SYLLABLES = ['ka', 'to', 'mi', 'ra', 'ne', 'so', 'vi', 'lu', 'de', 'ro', 'an', 'el', 'ix', 'or', 'us', 'ya']
+
+
+def make_username(rng, i):
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return f'{name}{i}' if rng.random() < 0.7 else f'{name}_{rng.choice(SYLLABLES)}{i}'
+
+
+def seed(path, users):
+    rng = random.Random(42)
+    names = [make_username(rng, i) for i in range(users)]
+    conn = sqlite3.connect(path)
+    conn.executescript('PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;' + BASELINE_SCHEMA)
+    conn.executemany(
+        'INSERT INTO user (id, username, email, glass_balance, is_premium, is_banned) VALUES (?, ?, ?, 100, 0, 0)',
+        ((i + 1, name, f'{name}@example.com') for i, name in enumerate(names))
+    )
+    conn.commit()
+    conn.close()
+    return names
+
+
+def make_queries(names, count):
+    rng = random.Random(7)
+    queries = []
+    for _ in range(count):
+        name = rng.choice(names)
+        if rng.random() < 0.5:
+            queries.append(name[:rng.randint(1, 6)])
+        else:
+            start = rng.randint(0, max(0, len(name) - 4))
+            queries.append(name[start:start + rng.randint(3, 5)])
+    return queries
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+def run(queries, fn):
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - started) * 1000)
+    return percentiles(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'search.db')
+    print(f'Seeding {args.users:,} users into {path} ...', file=sys.stderr)
+    names = seed(path, args.users)
+    queries = make_queries(names, args.queries)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_BINDS'] = {'archive': archive_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])}
+    init_db(app)
+    with app.app_context():
+        def ilike(query):
+            return User.query.filter(User.username.ilike(f'%{query}%'), User.id != 1).limit(10).all()
+
+        print('ILIKE baseline:', run(queries, ilike))
+
+        started = time.perf_counter()
+        migrations.upgrade()
+        print(f'migrations applied in {time.perf_counter() - started:.1f} s')
+
+        print('search.search_users:', run(queries, lambda query: search.search_users(query, exclude_ids=(1,))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Сериализация и сжатие истории переписки из N сообщений (по умолчанию 10 000).
+
+Сравнивает прежний путь (словари с isoformat() и jsonify стандартного
+провайдера Flask) с serializers.py (orjson, если установлен, и запасной
+json) и показывает размер ответа без сжатия, с gzip и brotli, а также
+время CPU на каждый шаг. База данных не нужна: сообщения создаются в памяти.
+
+Запуск (из корня репозитория):
+    python benchmarks/serialization.py --messages 10000 --repeat 20
+"""
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from models import Message, User  # noqa: E402
+import serializers  # noqa: E402
+from compression import brotli  # noqa: E402
+
+
+def make_messages(count):
+    alice = User(id=3, username='alice')
+    bob = User(id=4, username='bob')
+    start = datetime(2024, 1, 1)
+    messages = []
+    for i in range(count):
+        sender, receiver = (alice, bob) if i % 2 else (bob, alice)
+        messages.append(Message(
+            id=i + 1, sender_id=sender.id, receiver_id=receiver.id, sender=sender, receiver=receiver,
+            content=f'Сообщение номер {i}: привет, как дела? Встречаемся в {i % 24}:00',
+            content_type='text', timestamp=start + timedelta(seconds=37 * i)
+        ))
+    return messages
+
+
+def legacy_payload(messages, viewer_id):
+    # Как маршрут get_messages строил ответ до serializers.py
+    return {'status': 'success', 'has_more': False, 'messages': [{
+        'id': msg.id,
+        'content': msg.content,
+        'sender': msg.sender.username if msg.sender else 'Unknown',
+        'timestamp': msg.timestamp.isoformat(),
+        'is_own': msg.sender_id == viewer_id,
+        'content_type': msg.content_type,
+        'invitation_id': msg.invitation_id
+    } for msg in messages]}
+
+
+def serializer_payload(messages, viewer_id):
+    return {'status': 'success', 'has_more': False,
+            'messages': [serializers.message_data(msg, viewer_id) for msg in messages]}
+
+
+def measure(repeat, func):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = func()
+        timings.append((time.process_time() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--gzip-level', type=int, default=6)
+    parser.add_argument('--brotli-quality', type=int, default=5)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    legacy_app = Flask('legacy')
+    legacy_app.json = DefaultJSONProvider(legacy_app)
+    fast_app = Flask('fast')
+    fast_app.json = serializers.FastJSONProvider(fast_app)
+
+    def encoder(app):
+        def encode(payload):
+            with app.app_context():
+                return app.json.response(payload).get_data()
+        return encode
+
+    def stdlib(encode):
+        def encode_stdlib(payload):
+            backend, serializers.orjson = serializers.orjson, None
+            try:
+                return encode(payload)
+            finally:
+                serializers.orjson = backend
+        return encode_stdlib
+
+    variants = [
+        ('jsonify (before)', legacy_payload, encoder(legacy_app)),
+        ('serializers.py + stdlib json', serializer_payload, stdlib(encoder(fast_app))),
+    ]
+    if serializers.orjson is not None:
+        variants.append(('serializers.py + orjson', serializer_payload, encoder(fast_app)))
+
+    print(f'{args.messages:,} messages, median of {args.repeat} runs (CPU time, ms)\n')
+    print(f'{"serializer":<34} {"build":>9} {"encode":>9} {"total":>9} {"bytes":>12}')
+    bodies = {}
+    for name, build, encode in variants:
+        build_ms, payload = measure(args.repeat, lambda: build(messages, 3))
+        encode_ms, body = measure(args.repeat, lambda: encode(payload))
+        bodies[name] = body
+        print(f'{name:<34} {build_ms:>9.2f} {encode_ms:>9.2f} {build_ms + encode_ms:>9.2f} {len(body):>12,}')
+
+    body = bodies[variants[-1][0]]
+    compressors = [('gzip', lambda: gzip.compress(body, compresslevel=args.gzip_level, mtime=0))]
+    if brotli is not None:
+        compressors.append(('brotli', lambda: brotli.compress(body, quality=args.brotli_quality)))
+    else:
+        print('\nbrotli не установлен, сравнивается только gzip')
+
+    print(f'\n{"compression":<34} {"ms":>9} {"bytes":>12} {"ratio":>7}')
+    for name, func in compressors:
+        elapsed, compressed = measure(args.repeat, func)
+        print(f'{name:<34} {elapsed:>9.2f} {len(compressed):>12,} {len(body) / len(compressed):>6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Время запуска воркера: импорт приложения в чистом процессе.
+
+Каждый запуск - отдельный процесс Python, который импортирует app.py и
+считает SQL-запросы, выполненные при импорте. Для сравнения печатается и
+прежняя стоимость, когда каждый воркер при старте применял миграции и
+создавал начальных пользователей (init_database, теперь `flask init-db`).
+Параллельные запуски имитируют одновременный старт нескольких воркеров.
+
+Запуск (из корня репозитория):
+    python benchmarks/startup.py --runs 10 --workers 4
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+statements = []
+event.listen(Engine, 'before_cursor_execute', lambda *args: statements.append(1))
+
+started = time.perf_counter()
+import app as application
+result = {'import_ms': (time.perf_counter() - started) * 1000, 'import_statements': len(statements)}
+
+if sys.argv[1] == 'init':
+    del statements[:]
+    started = time.perf_counter()
+    with application.app.app_context():
+        application.init_database()
+    result.update(init_ms=(time.perf_counter() - started) * 1000, init_statements=len(statements))
+
+print(json.dumps(result))
+'''
+
+
+def boot(env, mode):
+    output = subprocess.run([sys.executable, '-c', CHILD, mode], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summary(results, key):
+    values = sorted(result[key] for result in results)
+    return {
+        'p50': round(statistics.median(values), 1),
+        'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        'max': round(values[-1], 1),
+    }
+
+
+def run(env, mode, runs, workers):
+    sequential = [boot(env, mode) for _ in range(runs)]
+    with ThreadPoolExecutor(workers) as pool:
+        concurrent = list(pool.map(lambda _: boot(env, mode), range(workers)))
+    return sequential, concurrent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='последовательных запусков')
+    parser.add_argument('--workers', type=int, default=4, help='одновременных запусков')
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}")
+    # Один раз, как flask init-db при развертывании: на пустой базе сюда
+    # входит и хеширование паролей начальных пользователей
+    first = boot(env, 'init')
+
+    report = {'config': vars(args), 'first init_database (empty database)': {
+        'init_ms': round(first['init_ms'], 1), 'sql_statements': first['init_statements']
+    }}
+    for mode, label in (('import', 'import only (now)'), ('init', 'import + init_database (before)')):
+        sequential, concurrent = run(env, mode, args.runs, args.workers)
+        keys = ['import_ms'] + (['init_ms'] if mode == 'init' else [])
+        report[label] = {
+            'sequential': {key: summary(sequential, key) for key in keys},
+            'concurrent': {key: summary(concurrent, key) for key in keys},
+            'sql_statements': sequential[0]['import_statements'] + sequential[0].get('init_statements', 0),
+        }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
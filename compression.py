@@ -0,0 +1,59 @@
+import gzip
+from flask import request
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него только gzip
+    brotli = None
+
+# Сжатие ответов API выше порога размера. Потоковые ответы (SSE, выгрузки)
+# не сжимаются: их нельзя буферизовать целиком.
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    # Учитывает q-значения заголовка Accept-Encoding клиента
+    return parse_accept_header(accept_encoding).best_match(available_encodings())
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+
+def init_compression(app):
+    config = app.config
+    if not config.get('COMPRESSION_ENABLED', True):
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if (response.is_streamed or response.direct_passthrough
+                or response.status_code in (204, 304) or response.status_code < 200
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if not encoding:
+            return response
+
+        response.set_data(compress(data, encoding, config))
+        response.headers['Content-Encoding'] = encoding
+        # Сжатое представление не побайтно совпадает с исходным: ETag слабый
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -1,6 +1,147 @@
 import os
 
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes', 'on') if value else default
+
+
+def database_uri():
+    # DATABASE_URL позволяет запускать то же приложение на PostgreSQL
+    uri = os.environ.get('DATABASE_URL') or 'sqlite:///gslase.db'
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def archive_database_uri(uri):
+    # Архив сообщений: рядом с файлом SQLite (gslase.db -> gslase_archive.db),
+    # на сервере БД - отдельная таблица в той же базе
+    archive_uri = os.environ.get('ARCHIVE_DATABASE_URL')
+    if archive_uri:
+        return archive_uri
+    if uri.startswith('sqlite:///') and ':memory:' not in uri:
+        root, ext = os.path.splitext(uri)
+        return f'{root}_archive{ext or ".db"}'
+    return uri
+
+
+def engine_options(uri):
+    options = {
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True),
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 1800),
+    }
+    # У SQLite в памяти свой пул без размеров
+    if not (uri.startswith('sqlite') and ':memory:' in uri):
+        options['pool_size'] = env_int('DB_POOL_SIZE', 10)
+        options['max_overflow'] = env_int('DB_MAX_OVERFLOW', 20)
+        options['pool_timeout'] = env_int('DB_POOL_TIMEOUT', 30)
+    return options
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here-change-in-production'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///gslase.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = database_uri()
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    ARCHIVE_DATABASE_URI = archive_database_uri(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_BINDS = {
+        'archive': {'url': ARCHIVE_DATABASE_URI, **engine_options(ARCHIVE_DATABASE_URI)}
+    }
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # PRAGMA для каждого нового соединения SQLite (см. database.py)
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': env_int('SQLITE_BUSY_TIMEOUT', 5000),  # мс ожидания блокировки вместо "database is locked"
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    }
+
+    # Метрики (/metrics) и журнал медленных запросов
+    METRICS_ENABLED = env_bool('METRICS_ENABLED', True)
+    # Доступ к /metrics: с адресов из списка или с токеном
+    # (Authorization: Bearer <токен>); по умолчанию только локально
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+                           if ip.strip()]
+    SLOW_REQUEST_MS = env_int('SLOW_REQUEST_MS', 500)
+    SLOW_QUERY_MS = env_int('SLOW_QUERY_MS', 100)
+    N_PLUS_ONE_THRESHOLD = 10  # одинаковых SQL за один HTTP-запрос
+
+    # Групповой commit для /api/send_message
+    MESSAGE_BATCHING = env_bool('MESSAGE_BATCHING', False)
+    MESSAGE_BATCH_SIZE = env_int('MESSAGE_BATCH_SIZE', 100)
+    MESSAGE_BATCH_DELAY_MS = env_int('MESSAGE_BATCH_DELAY_MS', 5)
+    MESSAGE_BATCH_TIMEOUT = 10  # секунд ожидания commit пачки
+
+    # Хеширование паролей: метод werkzeug вместе с параметрами стоимости.
+    # При смене метода хеш пользователя пересчитывается при следующем входе
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    PASSWORD_HASH_WORKERS = env_int('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+    PASSWORD_HASH_QUEUE = env_int('PASSWORD_HASH_QUEUE', 64)  # ожидающих сверх числа потоков
+    PASSWORD_HASH_TIMEOUT = 10  # секунд
+
+    # Кэш пользователей для user_loader
+    USER_CACHE_TTL = 60  # секунд
+    USER_CACHE_SIZE = 10000
+
+    # Ограничение частоты запросов (ratelimit.py): маршрут -> (запросов, за секунд).
+    # RATE_LIMIT_BACKEND = 'sqlite' делит лимиты между процессами через общий файл
+    RATE_LIMIT_ENABLED = env_bool('RATE_LIMIT_ENABLED', True)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH', 'ratelimit.db')
+    RATE_LIMIT_MAX_KEYS = 100000
+    RATE_LIMITS = {
+        'send_message': (30, 10),
+        'search_users': (20, 10),
+        'create_chat': (10, 60),
+        'login': (10, 60),
+    }
+
+    # Максимум получателей в одном массовом приглашении
+    INVITE_BULK_MAX = 1000
+
+    # Архивация: сообщения старше MESSAGE_ARCHIVE_DAYS переносятся в архив порциями
+    MESSAGE_ARCHIVE_DAYS = env_int('MESSAGE_ARCHIVE_DAYS', 180)
+    MESSAGE_ARCHIVE_BATCH_SIZE = 500
+
+    # Сжатие ответов API (gzip, brotli при наличии модуля) от COMPRESS_MIN_SIZE байт
+    COMPRESSION_ENABLED = env_bool('COMPRESSION_ENABLED', True)
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 5
+
+    # Офлайн-отчет по использованию (flask usage-report). REPORT_DATABASE_URL -
+    # реплика для чтения; без нее отчет читает основную базу в режиме только чтения
+    REPORT_DATABASE_URL = os.environ.get('REPORT_DATABASE_URL')
+    REPORT_DAYS = env_int('REPORT_DAYS', 30)
+    REPORT_CHUNK_SIZE = 10000
+
+    # Админ-панель: страница списка пользователей и выгрузка
+    ADMIN_PAGE_SIZE = 50
+    ADMIN_PAGE_SIZE_MAX = 500
+    EXPORT_CHUNK_SIZE = 1000
+
+    # Пагинация истории сообщений
+    MESSAGES_PAGE_SIZE = 50
+    MESSAGES_PAGE_SIZE_MAX = 200
+
+    # Пагинация списка чатов и приглашений на главной странице
+    CHATS_PAGE_SIZE = 50
+    CHATS_PAGE_SIZE_MAX = 200
+    INVITATIONS_PAGE_SIZE = 20
+    INVITATIONS_PAGE_SIZE_MAX = 100
+
+    # Шина событий между процессами: 'local' - один процесс, 'socket' - брокер
+    # на Unix-сокете (flask event-broker), путь относительно instance/
+    EVENT_BUS_BACKEND = os.environ.get('EVENT_BUS_BACKEND', 'local')
+    EVENT_BUS_SOCKET = os.environ.get('EVENT_BUS_SOCKET', 'events.sock')
+
+    # Поток событий (/api/stream)
+    STREAM_KEEPALIVE = 15  # секунд между keepalive-комментариями
+    STREAM_BACKLOG_LIMIT = 500  # максимум пропущенных сообщений при переподключении
@@ -0,0 +1,30 @@
+from sqlalchemy import event
+from models import db
+
+IN_CHUNK_SIZE = 500  # значений в одном IN (...), с запасом до лимита переменных SQLite
+
+
+def chunked(items, size=IN_CHUNK_SIZE):
+    """Делит список на части для запросов IN (...) по size значений."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def init_db(app):
+    """Подключает Flask-SQLAlchemy и настраивает движок под текущий бэкенд."""
+    db.init_app(app)
+    with app.app_context():
+        # Основная база и дополнительные (архив сообщений)
+        for engine in set(db.engines.values()):
+            if engine.dialect.name == 'sqlite':
+                pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+                event.listen(engine, 'connect', lambda conn, record: apply_sqlite_pragmas(conn, pragmas))
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict
+from serializers import dumps, loads
+
+logger = logging.getLogger('gslase.events')
+
+# События для подписчиков (новые сообщения, отметки прочтения) и служебные
+# темы (сброс кэшей). Внутри процесса доставляются сразу, между процессами -
+# через бэкенд: LocalBackend (один процесс) или SocketBackend с брокером на
+# Unix-сокете (flask event-broker). Если брокер недоступен, события остаются
+# локальными: клиенты догонят сообщения по Last-Event-ID, кэш истечет по TTL.
+
+
+class Subscription:
+    """Очередь событий одного подключенного клиента."""
+
+    def __init__(self, user_id, maxsize=256):
+        self.user_id = user_id
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Медленный клиент: событие теряется, при переподключении
+            # он догонит историю по курсору Last-Event-ID
+            pass
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """Подписка для асинхронного сервера: события приходят из любых потоков,
+    а читаются в цикле событий, не занимая поток на соединение."""
+
+    def __init__(self, user_id, maxsize=256):
+        self.user_id = user_id
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LocalBackend:
+    """Один процесс: события никуда не пересылаются."""
+
+    def start(self, dispatch):
+        pass
+
+    def send(self, message):
+        return False
+
+
+class SocketBackend:
+    """Пересылка событий другим процессам через EventBroker на Unix-сокете."""
+
+    def __init__(self, path, reconnect_delay=1.0):
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._socket = None
+        self._pid = None
+
+    def start(self, dispatch):
+        # Поток чтения нужен в каждом процессе: после fork он не наследуется
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._socket = None
+        threading.Thread(target=self._run, args=(dispatch,), name='event-bus', daemon=True).start()
+
+    def send(self, message):
+        data = dumps(message) + b'\n'
+        with self._lock:
+            if self._socket is None:
+                return False
+            try:
+                self._socket.sendall(data)
+                return True
+            except OSError:
+                self._socket = None
+                return False
+
+    def _run(self, dispatch):
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                time.sleep(self.reconnect_delay)
+                continue
+
+            with self._lock:
+                self._socket = sock
+            try:
+                for line in sock.makefile('rb'):
+                    try:
+                        dispatch(loads(line))
+                    except Exception:
+                        logger.exception('Ошибка обработки события')
+            except OSError:
+                pass
+            with self._lock:
+                if self._socket is sock:
+                    self._socket = None
+            sock.close()
+            logger.warning('Соединение с брокером событий потеряно, переподключение')
+            time.sleep(self.reconnect_delay)
+
+
+class EventBroker:
+    """Локальный брокер: каждую строку от процесса пересылает всем остальным."""
+
+    def __init__(self, path, send_timeout=5):
+        self.path = path
+        self.send_timeout = send_timeout
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        try:
+            while True:
+                client, _ = server.accept()
+                client.settimeout(self.send_timeout)
+                with self._lock:
+                    self._clients[client] = threading.Lock()
+                threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.path)
+
+    def _serve(self, client):
+        try:
+            for line in client.makefile('rb'):
+                self._forward(client, line)
+        except OSError:
+            pass
+        self._drop(client)
+
+    def _forward(self, origin, line):
+        with self._lock:
+            targets = [(client, lock) for client, lock in self._clients.items() if client is not origin]
+        for client, lock in targets:
+            try:
+                with lock:
+                    client.sendall(line)
+            except OSError:
+                # Процесс завис или завершился: он переподключится сам
+                self._drop(client)
+
+    def _drop(self, client):
+        with self._lock:
+            self._clients.pop(client, None)
+        try:
+            client.close()
+        except OSError:
+            pass
+
+
+class EventBus:
+    """Рассылка событий подписчикам по user_id и обработчикам служебных тем."""
+
+    def __init__(self, backend=None):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._handlers = defaultdict(list)
+        self.backend = backend or LocalBackend()
+
+    def init_app(self, app):
+        if app.config['EVENT_BUS_BACKEND'] == 'socket':
+            self.backend = SocketBackend(socket_path(app))
+        app.before_request(self.connect)
+
+    def connect(self):
+        self.backend.start(self.dispatch)
+
+    def subscribe(self, user_id, subscription=None):
+        self.connect()
+        subscription = subscription or Subscription(user_id)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event):
+        # Своим подписчикам сразу, остальным процессам через бэкенд
+        self._deliver(user_id, event)
+        self.connect()
+        self.backend.send({'user_id': user_id, 'event': event})
+
+    def on(self, topic, handler=None):
+        # Можно использовать и как декоратор: @bus.on('topic')
+        if handler is None:
+            return lambda func: self.on(topic, func)
+        self._handlers[topic].append(handler)
+        return handler
+
+    def emit(self, topic, payload=None):
+        """Служебное событие (например, сброс кэша) во всех процессах."""
+        self._handle(topic, payload)
+        self.connect()
+        self.backend.send({'topic': topic, 'payload': payload})
+
+    def dispatch(self, message):
+        # Событие, пришедшее от другого процесса
+        if 'topic' in message:
+            self._handle(message['topic'], message['payload'])
+        else:
+            self._deliver(message['user_id'], message['event'])
+
+    def _deliver(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def _handle(self, topic, payload):
+        for handler in self._handlers.get(topic, ()):
+            handler(payload)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+def socket_path(app):
+    path = app.config['EVENT_BUS_SOCKET']
+    return path if os.path.isabs(path) else os.path.join(app.instance_path, path)
+
+
+bus = EventBus()
@@ -0,0 +1,53 @@
+from datetime import datetime
+from sqlalchemy import func, insert, literal, select, update
+from database import chunked
+from models import db, User, GlassTransaction
+
+# Изменения баланса стеклов. Баланс меняется атомарным UPDATE на стороне
+# базы (без чтения-изменения-записи в Python), каждое изменение пишется в
+# журнал glass_transaction. Функции не делают commit - это решает вызывающий.
+
+BOT_USER_ID = 1
+
+
+def _increment(amount):
+    return {'glass_balance': func.coalesce(User.glass_balance, 0) + amount}
+
+
+def credit_user(user_id, amount, reason):
+    """Начисляет amount (отрицательное - списывает) и возвращает новый баланс."""
+    db.session.execute(
+        update(User).where(User.id == user_id).values(**_increment(amount))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(insert(GlassTransaction).values(
+        user_id=user_id, amount=amount, reason=reason, created_at=datetime.utcnow()
+    ))
+    return db.session.execute(select(User.glass_balance).where(User.id == user_id)).scalar()
+
+
+def _credit_where(condition, amount, reason):
+    # Два оператора на любое число пользователей: UPDATE и INSERT ... SELECT
+    result = db.session.execute(
+        update(User).where(condition).values(**_increment(amount))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(insert(GlassTransaction).from_select(
+        ['user_id', 'amount', 'reason', 'created_at'],
+        select(User.id, literal(amount), literal(reason), literal(datetime.utcnow())).where(condition)
+    ))
+    return result.rowcount
+
+
+def credit_users(user_ids, amount, reason):
+    """Начисляет amount каждому из user_ids, возвращает число затронутых."""
+    user_ids = list(dict.fromkeys(user_ids))
+    affected = 0
+    for chunk in chunked(user_ids):
+        affected += _credit_where(User.id.in_(chunk), amount, reason)
+    return affected
+
+
+def credit_all(amount, reason):
+    """Начисляет amount всем пользователям, кроме бота."""
+    return _credit_where(User.id != BOT_USER_ID, amount, reason)
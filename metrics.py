@@ -0,0 +1,182 @@
+import hmac
+import logging
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from models import db
+
+# Метрики по маршрутам: время ответа, число и время SQL-запросов, размер
+# ответа. Отдаются в текстовом формате Prometheus на /metrics - только
+# адресам из METRICS_ALLOWED_IPS или с токеном METRICS_TOKEN. Асинхронные
+# маршруты (asgi.py) пишут в те же гистограммы через record_request.
+
+logger = logging.getLogger('gslase.metrics')
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками endpoint и method."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self._series.items())
+            for labels, (counts, total, count) in items:
+                label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines)
+
+
+request_duration = Histogram(
+    'gslase_request_duration_seconds', 'Время обработки запроса', DURATION_BUCKETS)
+request_sql_statements = Histogram(
+    'gslase_request_sql_statements', 'Число SQL-запросов за HTTP-запрос', COUNT_BUCKETS)
+request_sql_duration = Histogram(
+    'gslase_request_sql_duration_seconds', 'Суммарное время SQL за HTTP-запрос', DURATION_BUCKETS)
+response_size = Histogram(
+    'gslase_response_size_bytes', 'Размер тела ответа', SIZE_BUCKETS)
+
+HISTOGRAMS = (request_duration, request_sql_statements, request_sql_duration, response_size)
+
+
+class RequestStats:
+    """Время и SQL-запросы одного HTTP-запроса."""
+
+    def __init__(self, endpoint, slow_query_ms):
+        self.endpoint = endpoint
+        self.slow_query_ms = slow_query_ms
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+
+
+# Запрос асинхронного маршрута (asgi.py): у него нет контекста Flask
+async_request_stats = ContextVar('async_request_stats', default=None)
+
+
+def current_stats():
+    # Запросы фоновых потоков (например, группового commit) к маршрутам не относятся
+    if has_request_context():
+        return g.get('request_stats')
+    return async_request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = current_stats()
+    if stats is None:
+        return
+    stats.sql_count += 1
+    stats.sql_time += elapsed
+    stats.statements[statement] += 1
+    if elapsed * 1000 >= stats.slow_query_ms:
+        logger.warning('Медленный SQL (%.1f мс) в %s: %s', elapsed * 1000, stats.endpoint, statement)
+
+
+def _handle_error(context):
+    # after_cursor_execute для упавшего запроса не вызывается: без этого
+    # отметка времени осталась бы в conn.info соединения из пула навсегда
+    connection = context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+def instrument_engine(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def record_request(config, stats, method, path, size=None):
+    """Записывает метрики завершенного запроса; size=None - размер неизвестен (поток)."""
+    elapsed = time.perf_counter() - stats.started
+    labels = (('endpoint', stats.endpoint or 'unknown'), ('method', method))
+
+    request_duration.observe(labels, elapsed)
+    request_sql_statements.observe(labels, stats.sql_count)
+    request_sql_duration.observe(labels, stats.sql_time)
+    if size is not None:
+        response_size.observe(labels, size)
+
+    if elapsed * 1000 >= config['SLOW_REQUEST_MS']:
+        logger.warning('Медленный запрос %s %s: %.1f мс, SQL: %d за %.1f мс',
+                       method, path, elapsed * 1000, stats.sql_count, stats.sql_time * 1000)
+
+    # Один и тот же запрос много раз за HTTP-запрос - характерный признак N+1
+    for statement, count in stats.statements.items():
+        if count >= config['N_PLUS_ONE_THRESHOLD']:
+            logger.warning('Возможный N+1 в %s: запрос выполнен %d раз: %s',
+                           stats.endpoint, count, statement)
+
+
+def metrics_allowed(config):
+    token = config.get('METRICS_TOKEN')
+    if token:
+        scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(value.encode(), token.encode()):
+            return True
+    return request.remote_addr in config.get('METRICS_ALLOWED_IPS', ())
+
+
+def init_metrics(app):
+    config = app.config
+    if not config.get('METRICS_ENABLED', True):
+        return
+
+    with app.app_context():
+        for engine in set(db.engines.values()):
+            instrument_engine(engine)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_stats = RequestStats(request.endpoint, config['SLOW_QUERY_MS'])
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_stats' not in g:
+            return response
+        # У потоковых ответов (SSE) размер заранее неизвестен
+        size = None if response.is_streamed else response.calculate_content_length() or 0
+        record_request(config, g.request_stats, request.method, request.path, size)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        # 404, а не 403: посторонним незачем знать о наличии эндпоинта
+        if not metrics_allowed(config):
+            abort(404)
+        body = '\n\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+        return Response(body, mimetype='text/plain; version=0.0.4')
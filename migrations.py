@@ -0,0 +1,288 @@
+from datetime import datetime
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text,
+                        case, func, inspect, select, text)
+from models import db, Chat, Message, User
+import search
+
+# Версионированные миграции схемы. Каждая миграция идемпотентна и создает
+# таблицы такими, какими они были в ее версии (замороженные Table ниже), а не
+# по текущим моделям: иначе новая база получала бы все колонки уже в первой
+# миграции, и "версия N" значила бы разное для новых и обновленных баз.
+# Изменение модели оформляется новой миграцией.
+
+VERSION_TABLE = 'schema_version'
+
+# Схема на момент введения миграций (миграция 1)
+baseline = MetaData()
+
+Table(
+    'user', baseline,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(64), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(256)),
+    Column('avatar_url', String(256)),
+    Column('glass_balance', Integer),
+    Column('is_premium', Boolean),
+    Column('created_at', DateTime),
+    Column('is_banned', Boolean),
+)
+
+Table(
+    'chat', baseline,
+    Column('id', Integer, primary_key=True),
+    Column('user1_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('user2_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'message', baseline,
+    Column('id', Integer, primary_key=True),
+    Column('sender_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('receiver_id', Integer, ForeignKey('user.id')),
+    Column('content', Text, nullable=False),
+    Column('content_type', String(20)),
+    Column('invitation_id', Integer, ForeignKey('invitation.id')),
+    Column('timestamp', DateTime),
+)
+
+Table(
+    'channel', baseline,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text),
+    Column('is_public', Boolean),
+    Column('is_private', Boolean),
+    Column('cost_to_join', Integer),
+    Column('creator_id', Integer, ForeignKey('user.id')),
+    Column('created_at', DateTime),
+)
+
+Table(
+    'invitation', baseline,
+    Column('id', Integer, primary_key=True),
+    Column('inviter_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('invited_user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('channel_name', String(100), nullable=False),
+    Column('status', String(20)),
+    Column('created_at', DateTime),
+)
+
+# Таблицы, добавленные позже, в том виде, в каком их создала своя миграция
+added = MetaData()
+Table('user', added, Column('id', Integer, primary_key=True))
+
+glass_transaction_table = Table(
+    'glass_transaction', added,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('amount', Integer, nullable=False),
+    Column('reason', String(50), nullable=False),
+    Column('created_at', DateTime),
+)
+
+usage_report_table = Table(
+    'usage_report', added,
+    Column('id', Integer, primary_key=True),
+    Column('generated_at', DateTime, nullable=False),
+    Column('days', Integer, nullable=False),
+    Column('data', Text, nullable=False),
+)
+
+archived_message_table = Table(
+    'archived_message', MetaData(),
+    Column('id', Integer, primary_key=True, autoincrement=False),
+    Column('sender_id', Integer, nullable=False),
+    Column('receiver_id', Integer),
+    Column('user_low', Integer),
+    Column('user_high', Integer),
+    Column('content', Text, nullable=False),
+    Column('content_type', String(20)),
+    Column('invitation_id', Integer),
+    Column('timestamp', DateTime),
+    Column('archived_at', DateTime),
+)
+
+
+def _column_names(table):
+    return {column['name'] for column in inspect(db.session.connection()).get_columns(table)}
+
+
+def _add_column(table, name, ddl):
+    # create_all не добавляет колонки в существующие таблицы
+    if name not in _column_names(table):
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+
+def _create_index(name, table, columns, connection=None):
+    # Явный DDL, а не индексы модели: индекс, добавленный в модель позже,
+    # создается своей миграцией
+    (connection or db.session.connection()).execute(
+        text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+def _low(a, b):
+    return case((a <= b, a), else_=b)
+
+
+def _high(a, b):
+    return case((a <= b, b), else_=a)
+
+
+def backfill_chat_summaries():
+    # Заполняет last_message_id/last_message_at для уже существующих чатов.
+    # Подзапрос идет по индексу ix_message_conversation
+    chat = Chat.__table__
+    message = Message.__table__
+    last_id = select(func.max(message.c.id)).where(
+        (message.c.user_low == chat.c.user_low) & (message.c.user_high == chat.c.user_high)
+    ).scalar_subquery()
+    last_at = select(message.c.timestamp).where(message.c.id == chat.c.last_message_id).scalar_subquery()
+
+    db.session.execute(chat.update().values(last_message_id=last_id))
+    db.session.execute(chat.update().values(last_message_at=last_at))
+
+
+def initial_schema():
+    # На базе, созданной до появления миграций, таблицы уже есть
+    baseline.create_all(bind=db.session.connection(), checkfirst=True)
+
+
+def chat_summary():
+    # Заполняются в conversation_keys, когда появится индекс по переписке
+    _add_column('chat', 'last_message_id', 'INTEGER REFERENCES message (id)')
+    _add_column('chat', 'last_message_at', 'TIMESTAMP')
+
+
+def conversation_keys():
+    _add_column('message', 'user_low', 'INTEGER')
+    _add_column('message', 'user_high', 'INTEGER')
+    _add_column('chat', 'user_low', 'INTEGER')
+    _add_column('chat', 'user_high', 'INTEGER')
+
+    message = Message.__table__
+    db.session.execute(message.update().where(
+        message.c.user_low.is_(None) & message.c.receiver_id.isnot(None)
+    ).values(
+        user_low=_low(message.c.sender_id, message.c.receiver_id),
+        user_high=_high(message.c.sender_id, message.c.receiver_id)
+    ))
+    db.session.execute(message.update().where(
+        message.c.user_low.is_(None)
+    ).values(user_low=message.c.sender_id))
+
+    chat = Chat.__table__
+    db.session.execute(chat.update().where(chat.c.user_low.is_(None)).values(
+        user_low=_low(chat.c.user1_id, chat.c.user2_id),
+        user_high=_high(chat.c.user1_id, chat.c.user2_id)
+    ))
+
+    _create_index('ix_message_conversation', 'message', 'user_low, user_high, id')
+    _create_index('ix_message_sender', 'message', 'sender_id, id')
+    _create_index('ix_message_receiver', 'message', 'receiver_id, id')
+    _create_index('ix_chat_users', 'chat', 'user_low, user_high')
+    _create_index('ix_chat_user_high', 'chat', 'user_high')
+    _create_index('ix_invitation_invited_status', 'invitation', 'invited_user_id, status')
+
+    backfill_chat_summaries()
+
+
+def username_search():
+    search.create_search_index(db.session.connection())
+
+
+def glass_ledger():
+    glass_transaction_table.create(bind=db.session.connection(), checkfirst=True)
+    _create_index('ix_glass_transaction_user', 'glass_transaction', 'user_id, id')
+
+
+def read_state():
+    for side in ('low', 'high'):
+        _add_column('chat', f'{side}_last_read_id', 'INTEGER DEFAULT 0')
+        _add_column('chat', f'{side}_unread_count', 'INTEGER DEFAULT 0')
+
+    # Существующая история считается прочитанной
+    chat = Chat.__table__
+    last_id = func.coalesce(chat.c.last_message_id, 0)
+    db.session.execute(chat.update().values(
+        low_last_read_id=last_id, high_last_read_id=last_id,
+        low_unread_count=0, high_unread_count=0
+    ))
+
+
+def message_archive():
+    # Отдельная база (bind 'archive'), поэтому своя транзакция
+    with db.engines['archive'].begin() as connection:
+        archived_message_table.create(bind=connection, checkfirst=True)
+        _create_index('ix_archived_message_conversation', 'archived_message', 'user_low, user_high, id', connection)
+        _create_index('ix_archived_message_sender', 'archived_message', 'sender_id, id', connection)
+        _create_index('ix_archived_message_receiver', 'archived_message', 'receiver_id, id', connection)
+
+
+def usage_report():
+    usage_report_table.create(bind=db.session.connection(), checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, 'initial schema', initial_schema),
+    (2, 'chat last message summary', chat_summary),
+    (3, 'conversation keys and indexes', conversation_keys),
+    (4, 'username search index', username_search),
+    (5, 'glass transaction ledger', glass_ledger),
+    (6, 'chat read state', read_state),
+    (7, 'message archive', message_archive),
+    (8, 'usage report', usage_report),
+]
+
+
+def current_version():
+    if not inspect(db.session.connection()).has_table(VERSION_TABLE):
+        return 0
+    return db.session.execute(text(f'SELECT MAX(version) FROM {VERSION_TABLE}')).scalar() or 0
+
+
+def upgrade():
+    # Применяет все миграции новее текущей версии, каждую в своей транзакции
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {VERSION_TABLE} '
+        '(version INTEGER PRIMARY KEY, name VARCHAR(100), applied_at TIMESTAMP)'
+    ))
+    db.session.commit()
+
+    version = current_version()
+    applied = []
+    for number, name, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        migration()
+        db.session.execute(
+            text(f'INSERT INTO {VERSION_TABLE} (version, name, applied_at) VALUES (:v, :n, :t)'),
+            {'v': number, 'n': name, 't': datetime.utcnow()}
+        )
+        db.session.commit()
+        applied.append(number)
+    return applied
+
+
+SEED_USERS = [
+    {'username': 'GSLASE_Bot', 'email': 'bot@gslase.com', 'password': 'bot_password', 'glass_balance': 0},
+    {'username': '@', 'email': 'admin@gslase.com', 'password': 'admin123', 'glass_balance': 1000,
+     'is_premium': True},
+]
+
+
+def seed_users():
+    # Бот (id 1) и администратор; повторный вызов ничего не меняет
+    created = []
+    for data in SEED_USERS:
+        fields = dict(data)
+        password = fields.pop('password')
+        if User.query.filter_by(username=fields['username']).first():
+            continue
+        user = User(**fields)
+        user.set_password(password)
+        db.session.add(user)
+        created.append(user.username)
+    db.session.commit()
+    return created
@@ -1,11 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import case, event
+from passwords import password_hasher
 from datetime import datetime
 
 db = SQLAlchemy()
 
 
+def conversation_key(user_a, user_b):
+    # Канонический ключ переписки: пара (меньший id, больший id)
+    if user_a is None or user_b is None:
+        return user_a if user_b is None else user_b, None
+    user_a, user_b = int(user_a), int(user_b)
+    return min(user_a, user_b), max(user_a, user_b)
+
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -18,29 +27,94 @@ class User(UserMixin, db.Model):
     is_banned = db.Column(db.Boolean, default=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
     def __repr__(self):
         return f'<User {self.username}>'
 
 
+class GlassTransaction(db.Model):
+    # Журнал изменений баланса: каждая выдача или списание стеклов
+    __table_args__ = (
+        db.Index('ix_glass_transaction_user', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User')
+
+
+class UsageReport(db.Model):
+    # Сводка офлайн-отчета (reports.py): одна строка на запуск, данные - JSON.
+    # Админ-панель читает только последнюю строку по первичному ключу
+    id = db.Column(db.Integer, primary_key=True)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    days = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
+
 class Chat(db.Model):
+    __table_args__ = (
+        db.Index('ix_chat_users', 'user_low', 'user_high'),
+        db.Index('ix_chat_user_high', 'user_high'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user1_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     user2_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_low = db.Column(db.Integer)
+    user_high = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Денормализованная сводка: обновляется в одной транзакции с отправкой сообщения
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'))
+    last_message_at = db.Column(db.DateTime)
+    # Отметки прочтения и счетчики непрочитанных для каждой стороны чата
+    low_last_read_id = db.Column(db.Integer, default=0)
+    high_last_read_id = db.Column(db.Integer, default=0)
+    low_unread_count = db.Column(db.Integer, default=0)
+    high_unread_count = db.Column(db.Integer, default=0)
 
     user1 = db.relationship('User', foreign_keys=[user1_id])
     user2 = db.relationship('User', foreign_keys=[user2_id])
+    last_message = db.relationship('Message', foreign_keys=[last_message_id])
+
+    @staticmethod
+    def between(user_a, user_b):
+        low, high = conversation_key(user_a, user_b)
+        return (Chat.user_low == low) & (Chat.user_high == high)
+
+    @staticmethod
+    def of_user(user_id):
+        return (Chat.user_low == user_id) | (Chat.user_high == user_id)
+
+    @staticmethod
+    def unread_count_of(user_id):
+        return case((Chat.user_low == user_id, Chat.low_unread_count), else_=Chat.high_unread_count)
+
+    @staticmethod
+    def last_read_id_of(user_id):
+        return case((Chat.user_low == user_id, Chat.low_last_read_id), else_=Chat.high_last_read_id)
 
 
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_conversation', 'user_low', 'user_high', 'id'),
+        db.Index('ix_message_sender', 'sender_id', 'id'),
+        db.Index('ix_message_receiver', 'receiver_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_low = db.Column(db.Integer)
+    user_high = db.Column(db.Integer)
     content = db.Column(db.Text, nullable=False)
     content_type = db.Column(db.String(20), default='text')
     invitation_id = db.Column(db.Integer, db.ForeignKey('invitation.id'))
@@ -50,6 +124,52 @@ class Message(db.Model):
     receiver = db.relationship('User', foreign_keys=[receiver_id])
     invitation = db.relationship('Invitation')
 
+    @staticmethod
+    def between(user_a, user_b):
+        low, high = conversation_key(user_a, user_b)
+        return (Message.user_low == low) & (Message.user_high == high)
+
+    @staticmethod
+    def of_user(user_id):
+        return (Message.sender_id == user_id) | (Message.receiver_id == user_id)
+
+
+class ArchivedMessage(db.Model):
+    # Холодные сообщения в отдельной базе (bind 'archive'), id сохраняются.
+    # Внешних ключей нет: пользователи и приглашения живут в основной базе
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_message'
+    __table_args__ = (
+        db.Index('ix_archived_message_conversation', 'user_low', 'user_high', 'id'),
+        db.Index('ix_archived_message_sender', 'sender_id', 'id'),
+        db.Index('ix_archived_message_receiver', 'receiver_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sender_id = db.Column(db.Integer, nullable=False)
+    receiver_id = db.Column(db.Integer)
+    user_low = db.Column(db.Integer)
+    user_high = db.Column(db.Integer)
+    content = db.Column(db.Text, nullable=False)
+    content_type = db.Column(db.String(20), default='text')
+    invitation_id = db.Column(db.Integer)
+    timestamp = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    sender = db.relationship('User', primaryjoin='foreign(ArchivedMessage.sender_id) == User.id', viewonly=True)
+    receiver = db.relationship('User', primaryjoin='foreign(ArchivedMessage.receiver_id) == User.id', viewonly=True)
+    invitation = db.relationship('Invitation', primaryjoin='foreign(ArchivedMessage.invitation_id) == Invitation.id',
+                                 viewonly=True)
+
+    @staticmethod
+    def between(user_a, user_b):
+        low, high = conversation_key(user_a, user_b)
+        return (ArchivedMessage.user_low == low) & (ArchivedMessage.user_high == high)
+
+    @staticmethod
+    def of_user(user_id):
+        return (ArchivedMessage.sender_id == user_id) | (ArchivedMessage.receiver_id == user_id)
+
 
 class Channel(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -65,6 +185,10 @@ class Channel(db.Model):
 
 
 class Invitation(db.Model):
+    __table_args__ = (
+        db.Index('ix_invitation_invited_status', 'invited_user_id', 'status'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     inviter_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     invited_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -73,4 +197,14 @@ class Invitation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     inviter = db.relationship('User', foreign_keys=[inviter_id])
-    invited_user = db.relationship('User', foreign_keys=[invited_user_id])
\ No newline at end of file
+    invited_user = db.relationship('User', foreign_keys=[invited_user_id])
+
+
+@event.listens_for(Message, 'before_insert')
+def set_message_conversation_key(mapper, connection, target):
+    target.user_low, target.user_high = conversation_key(target.sender_id, target.receiver_id)
+
+
+@event.listens_for(Chat, 'before_insert')
+def set_chat_conversation_key(mapper, connection, target):
+    target.user_low, target.user_high = conversation_key(target.user1_id, target.user2_id)
\ No newline at end of file
@@ -0,0 +1,79 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Хеширование паролей в отдельном пуле потоков. PBKDF2 и scrypt из hashlib
+# отпускают GIL, поэтому пул действительно распараллеливает работу, а лимит
+# очереди не дает волне логинов занять все рабочие потоки сервера.
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь на хеширование заполнена."""
+
+
+class PasswordHasher:
+    def __init__(self, method='pbkdf2:sha256:600000', workers=None, max_pending=64, timeout=10):
+        self.configure(method, workers, max_pending, timeout)
+
+    def configure(self, method, workers=None, max_pending=64, timeout=10):
+        self.method = method
+        self._prefix = None
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        # Прежний пул (init_app после конструктора) завершает начатые задачи и
+        # отпускает потоки; его задачи освобождают слоты своего семафора
+        previous = getattr(self, '_executor', None)
+        self._slots = threading.BoundedSemaphore(self.workers + max_pending)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+        if previous is not None:
+            previous.shutdown(wait=False)
+
+    def init_app(self, app):
+        config = app.config
+        self.configure(
+            config['PASSWORD_HASH_METHOD'],
+            config['PASSWORD_HASH_WORKERS'],
+            config['PASSWORD_HASH_QUEUE'],
+            config['PASSWORD_HASH_TIMEOUT']
+        )
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Слишком много одновременных проверок пароля')
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Задача остается в очереди и освободит слот, когда выполнится
+            raise PasswordHasherBusy('Проверка пароля не уложилась в PASSWORD_HASH_TIMEOUT')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    @property
+    def prefix(self):
+        # werkzeug дописывает параметры по умолчанию ('scrypt' -> 'scrypt:32768:8:1',
+        # 'pbkdf2' -> 'pbkdf2:sha256:600000'), поэтому префикс берется из настоящего
+        # хеша. Считается при первом обращении, а не при импорте: это полный расчет хеша
+        if self._prefix is None:
+            self._prefix = generate_password_hash('x', self.method).split('$', 1)[0]
+        return self._prefix
+
+    def needs_rehash(self, password_hash):
+        # Формат werkzeug: "<метод>$<соль>$<хеш>", метод вместе с параметрами стоимости
+        return bool(password_hash) and password_hash.split('$', 1)[0] != self.prefix
+
+
+password_hasher = PasswordHasher()
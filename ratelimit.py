@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request
+from flask_login import current_user
+
+# Ограничение частоты запросов: token bucket на ключ (пользователь или IP).
+# Ведро емкостью capacity пополняется со скоростью capacity / period токенов
+# в секунду, запрос тратит один токен. Проверка - O(1) над одной записью.
+
+
+class RateLimited(Exception):
+    """Запрос отклонен лимитером; retry_after - через сколько секунд повторить."""
+
+    def __init__(self, retry_after):
+        super().__init__('Слишком много запросов')
+        self.retry_after = retry_after
+
+
+def _refill(tokens, updated_at, now, capacity, rate):
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class MemoryBackend:
+    """Ведра в памяти процесса; при переполнении вытесняются давно не тронутые."""
+
+    blocking = False
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def consume(self, key, capacity, rate, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = capacity if bucket is None else _refill(bucket[0], bucket[1], now, capacity, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    """Общие для нескольких процессов ведра в файле SQLite.
+
+    Локальная замена внешнему хранилищу (например, Redis): тот же интерфейс
+    consume, атомарность обеспечивает транзакция BEGIN IMMEDIATE.
+    """
+
+    CLEANUP_EVERY = 1000
+    blocking = True  # ждет блокировку файла до 5 с; асинхронный режим вызывает его в пуле потоков
+
+    def __init__(self, path, idle_seconds=3600):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self._local = threading.local()
+        self._calls = 0
+        self._calls_lock = threading.Lock()
+        # init_app выполняется и в главном процессе сервера с предзагрузкой:
+        # соединение для создания таблицы сразу закрывается, чтобы воркеры
+        # не унаследовали его через fork
+        connection = self._open()
+        try:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+        finally:
+            connection.close()
+
+    def _open(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        return connection
+
+    def _connect(self):
+        # Соединение на поток и процесс: после fork открываем свое
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self._local.connection = self._open()
+            self._local.pid = pid
+        return self._local.connection
+
+    def consume(self, key, capacity, rate, now=None):
+        # Время стены, а не monotonic: его сравнивают разные процессы
+        now = time.time() if now is None else now
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated_at FROM rate_limit WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute(
+                'INSERT INTO rate_limit (key, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                (key, tokens, now)
+            )
+            with self._calls_lock:
+                self._calls += 1
+                cleanup = self._calls % self.CLEANUP_EVERY == 0
+            if cleanup:
+                # Давно не тронутое ведро уже полное - запись можно удалить
+                connection.execute('DELETE FROM rate_limit WHERE updated_at < ?', (now - self.idle_seconds,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.limits = {}
+        self.backend = MemoryBackend()
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RATE_LIMIT_ENABLED']
+        self.limits = dict(config['RATE_LIMITS'])
+        if config['RATE_LIMIT_BACKEND'] == 'sqlite':
+            path = config['RATE_LIMIT_SQLITE_PATH']
+            if not os.path.isabs(path):
+                path = os.path.join(app.instance_path, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path)
+        else:
+            self.backend = MemoryBackend(config['RATE_LIMIT_MAX_KEYS'])
+
+    def hit(self, name, key):
+        """Тратит токен лимита name для key; бросает RateLimited, если их нет."""
+        if not self.enabled or name not in self.limits:
+            return
+        capacity, period = self.limits[name]
+        allowed, retry_after = self.backend.consume(f'{name}:{key}', capacity, capacity / period)
+        if not allowed:
+            raise RateLimited(retry_after)
+
+    def limit(self, name, by='user', methods=None):
+        """Декоратор маршрута. by='user' - по пользователю (для анонимных по IP),
+        by='ip' - всегда по IP; methods ограничивает проверку методами запроса."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    if by == 'user' and current_user.is_authenticated:
+                        key = f'user:{current_user.id}'
+                    else:
+                        key = f'ip:{request.remote_addr}'
+                    self.hit(name, key)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+rate_limiter = RateLimiter()
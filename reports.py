@@ -0,0 +1,228 @@
+import logging
+import math
+import sqlite3
+from bisect import bisect_right
+from collections import Counter
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import create_engine, select, true
+from models import db, Chat, Invitation, Message, UsageReport, User
+from serializers import dumps, loads
+
+# Офлайн-отчет по использованию: активные пользователи по дням, сообщения на
+# переписку, доля принятых приглашений и распределение балансов. Таблицы
+# читаются порциями через отдельное соединение только для чтения, результат
+# сохраняется одной строкой в usage_report. Архивная база не читается: окно
+# отчета не длиннее срока архивации (MESSAGE_ARCHIVE_DAYS), более длинное
+# generate_report сокращает до него.
+
+logger = logging.getLogger('gslase.reports')
+
+EPOCH = date(1970, 1, 1)
+BALANCE_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000)
+
+
+def load_numpy():
+    # Импорт при построении отчета, а не при старте воркера: app.py импортирует
+    # этот модуль, а numpy добавляет к запуску десятки миллисекунд.
+    # numpy необязателен, без него агрегирование на чистом Python
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def percentile(values, percent):
+    # Линейная интерполяция между соседними рангами (как numpy.percentile по
+    # умолчанию) по отсортированному списку, округление как у среднего
+    position = (len(values) - 1) * percent / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return round(values[lower] + (values[upper] - values[lower]) * (position - lower), 2)
+
+
+def readonly_engine():
+    # Возвращает (движок, нужно_ли_закрыть)
+    url = current_app.config['REPORT_DATABASE_URL']
+    if url:
+        return create_engine(url), True
+    engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        path = engine.url.database
+        return create_engine('sqlite://', creator=lambda: sqlite3.connect(
+            f'file:{path}?mode=ro', uri=True, check_same_thread=False)), True
+    if engine.dialect.name == 'postgresql':
+        return engine.execution_options(postgresql_readonly=True), False
+    return engine, False
+
+
+def stream(connection, statement, chunk_size):
+    # Порции строк без загрузки всей таблицы в память
+    result = connection.execution_options(stream_results=True).execute(statement)
+    for rows in result.partitions(chunk_size):
+        yield rows
+
+
+def day_number(value):
+    return (value.date() - EPOCH).days
+
+
+def daily_active_users(chunks):
+    # Пользователь активен в день, если отправил хотя бы одно сообщение
+    pairs = set()
+    np = load_numpy()
+    for rows in chunks:
+        senders, timestamps = zip(*rows)
+        if np is not None:
+            days = np.array(timestamps, dtype='datetime64[D]').astype(np.int64)
+            pairs.update(np.unique((days << 32) | np.array(senders, dtype=np.int64)).tolist())
+        else:
+            pairs.update(day_number(timestamp) << 32 | sender for sender, timestamp in rows)
+    per_day = Counter(key >> 32 for key in pairs)
+    return [{'date': (EPOCH + timedelta(days=day)).isoformat(), 'users': per_day[day]} for day in sorted(per_day)]
+
+
+def conversation_counts(chunks):
+    counts = Counter()
+    np = load_numpy()
+    for rows in chunks:
+        if np is not None:
+            keys = np.array(rows, dtype=np.int64)
+            unique, numbers = np.unique((keys[:, 0] << 32) | keys[:, 1], return_counts=True)
+            counts.update(dict(zip(unique.tolist(), numbers.tolist())))
+        else:
+            counts.update(low << 32 | high for low, high in rows)
+    return counts
+
+
+def conversation_stats(counts, chat_chunks):
+    chats = silent = 0
+    for rows in chat_chunks:
+        chats += len(rows)
+        silent += sum(1 for low, high in rows if (low << 32 | high) not in counts)
+
+    values = sorted(counts.values())
+    if not values:
+        return {'chats': chats, 'active': 0, 'silent': silent, 'messages': 0}
+    return {
+        'chats': chats,
+        'active': len(values),
+        'silent': silent,
+        'messages': sum(values),
+        'mean': round(sum(values) / len(values), 2),
+        'median': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'max': values[-1]
+    }
+
+
+def invitation_stats(chunks):
+    statuses = Counter()
+    np = load_numpy()
+    for rows in chunks:
+        if np is not None:
+            unique, numbers = np.unique(np.array([row[0] or 'pending' for row in rows]), return_counts=True)
+            statuses.update(dict(zip(unique.tolist(), numbers.tolist())))
+        else:
+            statuses.update(row[0] or 'pending' for row in rows)
+    decided = statuses['accepted'] + statuses['rejected']
+    return {
+        'total': sum(statuses.values()),
+        'pending': statuses['pending'],
+        'accepted': statuses['accepted'],
+        'rejected': statuses['rejected'],
+        'acceptance_rate': round(statuses['accepted'] / decided, 4) if decided else None
+    }
+
+
+def balance_distribution(chunks):
+    buckets = [0] * len(BALANCE_BUCKETS)
+    np = load_numpy()
+    users = total = 0
+    highest = None
+    for rows in chunks:
+        balances = [row[0] or 0 for row in rows]
+        if np is not None:
+            array = np.array(balances, dtype=np.int64)
+            # Отрицательные балансы попадают в первую корзину
+            indexes = np.maximum(np.searchsorted(BALANCE_BUCKETS, array, side='right') - 1, 0)
+            for index, number in zip(*np.unique(indexes, return_counts=True)):
+                buckets[index] += int(number)
+            chunk_max = int(array.max())
+        else:
+            for balance in balances:
+                buckets[max(bisect_right(BALANCE_BUCKETS, balance) - 1, 0)] += 1
+            chunk_max = max(balances)
+        users += len(balances)
+        total += sum(balances)
+        highest = chunk_max if highest is None else max(highest, chunk_max)
+
+    bounds = list(BALANCE_BUCKETS[1:]) + [None]
+    return {
+        'users': users,
+        'total': total,
+        'mean': round(total / users, 2) if users else 0,
+        'max': highest,
+        'buckets': [{'from': low, 'to': high, 'users': number}
+                    for low, high, number in zip(BALANCE_BUCKETS, bounds, buckets)]
+    }
+
+
+def build_report(connection, days, chunk_size):
+    since = datetime.utcnow() - timedelta(days=days)
+    # Сообщения окна лежат в конце таблицы: начинаем с первого id не старше since
+    first_id = connection.execute(select(Message.id).where(
+        Message.timestamp >= since
+    ).order_by(Message.id.asc()).limit(1)).scalar()
+
+    def messages(*columns, condition=true()):
+        return stream(connection, select(*columns).where(
+            Message.id >= first_id, Message.timestamp >= since, condition
+        ).order_by(Message.id), chunk_size)
+
+    if first_id is None:
+        active, counts = [], Counter()
+    else:
+        active = daily_active_users(messages(Message.sender_id, Message.timestamp))
+        counts = conversation_counts(messages(Message.user_low, Message.user_high,
+                                              condition=Message.user_high.isnot(None)))
+
+    return {
+        'since': since,
+        'daily_active_users': active,
+        'conversations': conversation_stats(counts, stream(
+            connection, select(Chat.user_low, Chat.user_high).order_by(Chat.id), chunk_size)),
+        'invitations': invitation_stats(stream(
+            connection, select(Invitation.status).order_by(Invitation.id), chunk_size)),
+        'balances': balance_distribution(stream(
+            connection, select(User.glass_balance).where(User.id != 1).order_by(User.id), chunk_size))
+    }
+
+
+def generate_report(days, chunk_size=10000):
+    """Строит отчет за последние days дней и сохраняет его в usage_report."""
+    archive_days = current_app.config['MESSAGE_ARCHIVE_DAYS']
+    if days > archive_days:
+        # Старше этого сообщения могут быть в архиве, и отчет их бы не учел
+        logger.warning('Окно отчета %d дн. длиннее срока архивации, сокращено до %d дн.', days, archive_days)
+        days = archive_days
+    engine, dispose = readonly_engine()
+    try:
+        with engine.connect() as connection:
+            data = build_report(connection, days, chunk_size)
+    finally:
+        if dispose:
+            engine.dispose()
+
+    report = UsageReport(days=days, data=dumps(data).decode())
+    db.session.add(report)
+    db.session.commit()
+    return report
+
+
+def latest_report():
+    report = UsageReport.query.order_by(UsageReport.id.desc()).first()
+    if report is None:
+        return None
+    return {'generated_at': report.generated_at, 'days': report.days, **loads(report.data)}
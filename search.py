@@ -0,0 +1,110 @@
+import time
+from sqlalchemy import inspect, text
+from models import db, User
+
+# Поиск пользователей по username. На SQLite используется индекс
+# username COLLATE NOCASE для префиксов и FTS5-таблица с триграммами
+# (user_search) для вхождения в середину строки; она поддерживается
+# триггерами при регистрации и изменении пользователей.
+
+SEARCH_TABLE = 'user_search'
+TRIGRAM_MIN_LENGTH = 3  # триграммный индекс не ищет подстроки короче трех символов
+FTS_RECHECK_SECONDS = 60
+
+_fts_available = {}
+
+
+def fts_available():
+    # Таблица появляется только миграцией, поэтому наличие кэшируется на
+    # движок навсегда. Отсутствие перепроверяется раз в FTS_RECHECK_SECONDS:
+    # воркер, запущенный до flask db-upgrade, переходит на FTS без перезапуска
+    engine = db.engine
+    available, checked_at = _fts_available.get(engine, (False, None))
+    if not available and (checked_at is None or time.monotonic() - checked_at >= FTS_RECHECK_SECONDS):
+        available = inspect(engine).has_table(SEARCH_TABLE)
+        _fts_available[engine] = (available, time.monotonic())
+    return available
+
+
+def create_search_index(connection):
+    # Вызывается из миграции; возвращает False, если SQLite собран без FTS5/trigram
+    if connection.dialect.name != 'sqlite':
+        return False
+
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_user_username_nocase ON user (username COLLATE NOCASE)'))
+    try:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            f"username, content='user', content_rowid='id', tokenize='trigram')"
+        ))
+    except Exception:
+        return False
+
+    connection.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS user_search_insert AFTER INSERT ON user BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, username) VALUES (new.id, new.username);
+        END"""))
+    connection.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS user_search_delete AFTER DELETE ON user BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, username) VALUES ('delete', old.id, old.username);
+        END"""))
+    connection.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS user_search_update AFTER UPDATE OF username ON user BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, username) VALUES ('delete', old.id, old.username);
+            INSERT INTO {SEARCH_TABLE} (rowid, username) VALUES (new.id, new.username);
+        END"""))
+    connection.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"))
+    _fts_available.clear()
+    return True
+
+
+def _prefix_ids(query, exclude_ids, limit):
+    # Диапазон по индексу NOCASE: все username, начинающиеся с query
+    rows = db.session.execute(text(
+        'SELECT id FROM user WHERE username >= :low COLLATE NOCASE AND username < :high COLLATE NOCASE '
+        'ORDER BY username COLLATE NOCASE LIMIT :limit'
+    ), {'low': query, 'high': query + '\U0010ffff', 'limit': limit + len(exclude_ids)})
+    return [row[0] for row in rows if row[0] not in exclude_ids][:limit]
+
+
+def _substring_ids(query, exclude_ids, limit):
+    # Без ORDER BY rank: FTS5 останавливается после первых limit совпадений
+    match = '"' + query.replace('"', '""') + '"'
+    rows = db.session.execute(text(
+        f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match LIMIT :limit'
+    ), {'match': match, 'limit': limit + len(exclude_ids)})
+    return [row[0] for row in rows if row[0] not in exclude_ids][:limit]
+
+
+def search_users(query, exclude_ids=(), limit=10):
+    """Сначала совпадения по префиксу, затем по вхождению, не больше limit."""
+    exclude_ids = set(exclude_ids)
+
+    if not fts_available():
+        return User.query.filter(
+            User.username.ilike(f'%{query}%'),
+            User.id.notin_(exclude_ids)
+        ).limit(limit).all()
+
+    prefix_ids = _prefix_ids(query, exclude_ids, limit)
+    substring_ids = []
+    if len(prefix_ids) < limit:
+        exclude_ids |= set(prefix_ids)
+        if len(query) >= TRIGRAM_MIN_LENGTH:
+            substring_ids = _substring_ids(query, exclude_ids, limit - len(prefix_ids))
+        else:
+            # Короткие запросы: просмотр таблицы, но LIMIT обрывает его на первых совпадениях
+            substring_ids = [user.id for user in User.query.with_entities(User.id).filter(
+                User.username.ilike(f'%{query}%'),
+                User.id.notin_(exclude_ids)
+            ).limit(limit - len(prefix_ids))]
+
+    ids = prefix_ids + substring_ids
+    if not ids:
+        return []
+    users = {user.id: user for user in User.query.filter(User.id.in_(ids)).all()}
+
+    # Префиксные совпадения уже упорядочены индексом, среди остальных короткие выше
+    substring = sorted((users[user_id] for user_id in substring_ids if user_id in users),
+                       key=lambda user: (len(user.username), user.username.lower()))
+    return [users[user_id] for user_id in prefix_ids if user_id in users] + substring
@@ -0,0 +1,92 @@
+import json
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, см. requirements-speedups.txt
+    orjson = None
+
+# Общая сериализация ответов API. Даты отдаются в ISO 8601 самим
+# JSON-бэкендом, поэтому строки не вызывают isoformat() по отдельности.
+# Если установлен orjson, он используется вместо стандартного json.
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(obj):
+    """Сериализует obj в UTF-8 байты без лишних пробелов."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask поверх dumps/loads: jsonify во всех маршрутах."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def message_data(msg, viewer_id):
+    # Подходит и для Message, и для ArchivedMessage
+    return {
+        'id': msg.id,
+        'content': msg.content,
+        'sender': msg.sender.username if msg.sender else 'Unknown',
+        'timestamp': msg.timestamp,
+        'is_own': msg.sender_id == viewer_id,
+        'content_type': msg.content_type,
+        'invitation_id': msg.invitation_id
+    }
+
+
+def user_data(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'avatar': user.avatar_url
+    }
+
+
+def invitation_data(row):
+    invitation_id, channel_name, inviter, created_at = row
+    return {
+        'id': invitation_id,
+        'channel_name': channel_name,
+        'inviter': inviter,
+        'created_at': created_at
+    }
+
+
+def chat_data(row):
+    # Строка user_chats_statement: чат, собеседник, последнее сообщение, прочтение
+    chat_id, other_id, other_username, last_content, last_at, unread, peer_read = row
+    return {
+        'chat_id': chat_id,
+        'other_user_id': other_id,
+        'other_username': other_username,
+        'last_message': last_content if last_content is not None else 'Нет сообщений',
+        'last_message_time': last_at,
+        'unread_count': unread or 0,
+        'peer_last_read_id': peer_read or 0
+    }